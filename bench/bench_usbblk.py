@@ -0,0 +1,285 @@
+#!/usr/bin/python3
+"""
+    Benchmarks of the hot paths of lsusbblk without USB hardware.
+
+    Synthetic udev devices, sysfs attribute files, a generated usb.ids file
+    and a fake usb.core.find are fed into the classes of lib.usbblk.
+    Enumeration, id lookup, serialisation, table rendering and I/O
+    statistics sampling are timed at a number of attached devices. Results
+    can be stored as JSON and compared with a stored baseline:
+
+        bench_usbblk.py --save baseline.json
+        bench_usbblk.py --compare baseline.json
+
+    bench_usbblk.py
+
+    -*- Mode: Python; coding: utf-8; indent-tabs-mode: t; -*-
+    -*- Mode: Python; c-basic-offset: 4; tab-width: 4 -*-
+
+    ----------------------------------------------------------------------------
+"""
+
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "src"))
+
+import lib.iostat as iostat  # noqa: E402
+import lib.output as output  # noqa: E402
+import lib.usbblk as usbblk  # noqa: E402
+
+SCALES = [1, 16, 256, 4096]
+VENDORS = 3000  # Vendors in the generated usb.ids, about the size of the real
+PRODUCTS = 6  # Products per vendor
+
+
+class fakeparent:
+    """udev usb_device parent with the sysfs attributes used by lsusbblk"""
+
+    def __init__(self, bus, address):
+        self.attributes = {
+            "busnum": str(bus).encode(),
+            "devnum": str(address).encode(),
+            "version": b" 3.20",
+            "speed": b"5000",
+        }
+        self.properties = {"BUSNUM": f"{bus:03d}", "DEVNUM": f"{address:03d}"}
+
+
+class fakedevice:
+    """udev block device of an USB disk"""
+
+    def __init__(self, i, sysfs, sysfs_parent=True):
+        vid = f"{(i % VENDORS) * 3 + 1:04x}"
+        pid = f"{i % PRODUCTS:04x}"
+        name = f"sd{i}"
+        self.properties = {
+            "DEVNAME": f"/dev/{name}",
+            "ID_BUS": "usb",
+            "DEVTYPE": "disk",
+            "ID_TYPE": "disk",
+            "ID_USB_DRIVER": "usb-storage",
+            "ID_VENDOR": "Vendor",
+            "ID_VENDOR_ENC": "Vendor\\x20",
+            "ID_VENDOR_ID": vid,
+            "ID_MODEL": f"Model_{i}",
+            "ID_MODEL_ENC": f"Model\\x20{i}",
+            "ID_MODEL_ID": pid,
+            "ID_REVISION": "1.00",
+            "ID_SERIAL_SHORT": f"SN{i:08d}",
+            "ID_SERIAL": f"Vendor_Model_{i}_SN{i:08d}-0:0",
+            "ID_USB_INTERFACES": ":080650:",
+            "ID_USB_INTERFACE_NUM": "00",
+            "ID_FS_LABEL": f"STICK{i}",
+            "ID_FS_TYPE": "vfat",
+            "MAJOR": "8",
+            "MINOR": str(i * 16),
+            "USEC_INITIALIZED": str(1000000 + i),
+        }
+        self.device_node = self.properties["DEVNAME"]
+        self.sys_path = os.path.join(sysfs, name)
+        self.parent = fakeparent(1 + i // 127, 1 + i % 127) if sysfs_parent else None
+
+        os.makedirs(self.sys_path, exist_ok=True)
+        with open(os.path.join(self.sys_path, "size"), "w") as f:
+            f.write(f"{(i + 1) * 2 ** 21}\n")
+        with open(os.path.join(self.sys_path, "stat"), "w") as f:
+            f.write(" ".join(str(i * n) for n in range(17)) + "\n")
+
+    def get(self, key, default=None):
+        return self.properties.get(key, default)
+
+    def find_parent(self, subsystem, device_type=None):
+        return self.parent
+
+
+class fakecontext:
+    """pyudev context listing the synthetic devices"""
+
+    def __init__(self, devices):
+        self.devices = devices
+
+    def list_devices(self, **kwargs):
+        return iter(self.devices)
+
+
+class fakeusb:
+    """pyusb device matching a synthetic udev device"""
+
+    def __init__(self, device):
+        self.idVendor = int(device.properties["ID_VENDOR_ID"], 16)
+        self.idProduct = int(device.properties["ID_MODEL_ID"], 16)
+        self.serial_number = device.properties["ID_SERIAL_SHORT"]
+        self.bus = 1
+        self.address = int(device.properties["MINOR"]) // 16 % 127 + 1
+        self.bcdUSB = 0x0320
+        self.speed = 4
+
+
+def generate_usbids(path):
+    """Write usb.ids file with VENDORS vendors of PRODUCTS products"""
+    with open(path, "w", encoding="latin-1") as f:
+        f.write("# Synthetic list of USB ID's\n")
+        for v in range(VENDORS):
+            f.write(f"{v * 3 + 1:04x}  Vendor {v} Corp.\n")
+            for p in range(PRODUCTS):
+                f.write(f"\t{p:04x}  Product {p} of vendor {v}\n")
+        f.write("# List of known device classes, subclasses and protocols\n")
+        f.write("C 00  (Defined at Interface level)\n")
+
+
+def render_table(devices, prop):
+    """Render the table of lsusbblk into a string"""
+    op = output.formated_print(mono=True)
+    rows = [[d.get(pr) for pr in prop] for d in devices.get_devices()]
+    return op.format_table([pr.upper() for pr in prop], rows)
+
+
+def measure(func, repeat, budget=2.0, minimum=0.1):
+    """Return best wall time of func. func is called at least repeat times and
+    for at least minimum seconds, unless the budget in seconds is used"""
+    best = None
+    count = 0
+    start = time.perf_counter()
+    while True:
+        t = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - t
+        best = elapsed if best is None else min(best, elapsed)
+        count += 1
+        used = time.perf_counter() - start
+        if used > budget or (count >= repeat and used > minimum):
+            return best
+
+
+def run(scales, repeat, workdir):
+    """Run all benchmarks, return list of results"""
+    idsfile = os.path.join(workdir, "usb.ids")
+    generate_usbids(idsfile)
+    os.environ["XDG_CACHE_HOME"] = os.path.join(workdir, "cache")
+    ids = usbblk.usbids(localfile=idsfile)
+    ids.getids("0001", "0000")  # Compile the index
+
+    # libusb is only used when sysfs lacks the information
+    try:
+        import usb.core
+    except ImportError:
+        usb = None
+
+    prop = ["device", "usbver", "vendor", "model", "id", "size", "serial", "label"]
+    results = []
+
+    def result(name, n, seconds):
+        results.append({"name": name, "devices": n, "seconds": seconds})
+        print(f"{name:<16} {n:>6} {seconds * 1000:>10.3f} ms")
+
+    for n in scales:
+        sysfs = os.path.join(workdir, f"sysfs{n}")
+        devices = [fakedevice(i, sysfs) for i in range(n)]
+        context = fakecontext(devices)
+
+        def enumerate_all(jobs):
+            inventory = usbblk.usbblk(True, ids, jobs=jobs, context=context)
+            inventory.probe()
+            return inventory
+
+        result("enumerate", n, measure(lambda: enumerate_all(1), repeat))
+        result("enumerate_par", n, measure(lambda: enumerate_all(8), repeat))
+
+        if usb is not None:
+            legacy = [fakedevice(i, sysfs, sysfs_parent=False) for i in range(n)]
+            fakes = [fakeusb(d) for d in legacy]
+            find = usb.core.find
+            usb.core.find = lambda **kwargs: iter(fakes)
+            try:
+                context = fakecontext(legacy)
+                seconds = measure(lambda: enumerate_all(1), repeat)
+                result("enumerate_usb", n, seconds)
+            finally:
+                usb.core.find = find
+                context = fakecontext(devices)
+
+        keys = [(d.get("ID_VENDOR_ID"), d.get("ID_MODEL_ID")) for d in devices]
+
+        def lookup():
+            return [ids.getids(v, p) for v, p in keys]
+
+        result("ids_lookup", n, measure(lookup, repeat))
+
+        inventory = enumerate_all(8)
+        result("serialise", n, measure(inventory.serialise, repeat))
+        result("serialise_prop", n, measure(lambda: inventory.serialise(prop), repeat))
+        result("table", n, measure(lambda: render_table(inventory, prop), repeat))
+
+        stats = iostat.iostat()
+        for d in devices:
+            stats.add(d.device_node, d.sys_path)
+        result("iostat_sample", n, measure(stats.sample, repeat))
+        stats.close()
+
+    def load():
+        return usbblk.usbids(localfile=idsfile).getids("0001", "0000")
+
+    result("ids_load", VENDORS, measure(load, repeat))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print ratio to baseline, return number of regressions"""
+    base = {(r["name"], r["devices"]): r["seconds"] for r in baseline["results"]}
+    regressions = 0
+    for r in results:
+        key = (r["name"], r["devices"])
+        if key not in base or not base[key]:
+            continue
+        ratio = r["seconds"] / base[key]
+        mark = ""
+        if ratio > tolerance:
+            mark = " REGRESSION"
+            regressions += 1
+        print(f"{r['name']:<16} {r['devices']:>6} {ratio:>8.2f}x{mark}")
+    return regressions
+
+
+def main():
+    ap = ArgumentParser(description="lsusbblk benchmarks without USB hardware")
+    add = ap.add_argument
+    add("-n", "--scales", help="Comma separated numbers of devices", type=str)
+    add("-r", "--repeat", help="Repetitions per benchmark", type=int, default=5)
+    add("--save", help="Store results as JSON in file", type=str)
+    add("--compare", help="Compare with results stored in file", type=str)
+    add("--tolerance", help="Slow down counted as regression", type=float, default=1.25)
+    args = ap.parse_args()
+
+    scales = SCALES
+    if args.scales:
+        scales = [int(n) for n in args.scales.split(",")]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results = run(scales, args.repeat, workdir)
+
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
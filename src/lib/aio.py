@@ -0,0 +1,106 @@
+"""
+    This module defines the asyncio interface of lsusbblk. Enumeration and
+    probes, that block on sysfs, ioctl and libusb, run in the default
+    executor of the event loop. Device events are read when the loop reports
+    the udev monitor readable, so no thread waits for udev.
+
+        import lib.aio as lsusbblk
+
+        async def station():
+            devices = await lsusbblk.enumerate_devices(["device", "size"])
+            async for action, name in lsusbblk.events(devices, ["device", "size"]):
+                if action == "add":
+                    print(devices.get(name).get_all())
+
+    aio.py
+
+    -*- Mode: Python; coding: utf-8; indent-tabs-mode: t; -*-
+    -*- Mode: Python; c-basic-offset: 4; tab-width: 4 -*-
+
+    ----------------------------------------------------------------------------
+"""
+
+import asyncio
+import functools
+
+from lib import api
+
+
+async def enumerate_devices(
+    properties=None,
+    human_readable=True,
+    filter=None,
+    jobs=8,
+    timeout=5.0,
+    cache=None,
+    context=None,
+):
+    """Return usbblk inventory, as lib.api.enumerate_devices, with the
+    properties, default all, of all devices probed"""
+    loop = asyncio.get_running_loop()
+
+    def scan():
+        api.check_properties(properties)
+        inventory = api.enumerate_devices(
+            human_readable, filter, jobs, timeout, cache, context
+        )
+        inventory.probe(properties)
+        return inventory
+
+    return await loop.run_in_executor(None, scan)
+
+
+async def probe(inventory, properties=None, names=None):
+    """Resolve properties, default all, of the named devices, default all
+    devices, of the inventory"""
+    loop = asyncio.get_running_loop()
+    call = functools.partial(inventory.probe, properties, names)
+    await loop.run_in_executor(None, call)
+
+
+async def readable(fd):
+    """Wait until file descriptor fd is readable"""
+    loop = asyncio.get_running_loop()
+    ready = loop.create_future()
+
+    def wake():
+        if not ready.done():
+            ready.set_result(None)
+
+    loop.add_reader(fd, wake)
+    try:
+        await ready
+    finally:
+        loop.remove_reader(fd)
+
+
+async def events(inventory, properties=None, expression=None):
+    """Async generator of inventory changes as tuples (action, name), action
+    is "add", "remove" or "change". Added and changed devices are probed
+    for the properties, default none, before they are yielded. Devices not
+    matching the filter expression, parsed by lib.filterexpr, are dropped,
+    a changed device that no longer matches is reported removed."""
+    loop = asyncio.get_running_loop()
+    api.check_properties(properties)
+    await loop.run_in_executor(None, inventory.start_monitor)
+
+    while True:
+        while not inventory.pending:
+            await readable(inventory.monitor.fileno())
+            while (device := inventory.monitor.poll(0)) is not None:
+                event = inventory.handle_event(device)
+                if event is not None:
+                    inventory.pending.append(event)
+
+        action, name = inventory.pending.pop(0)
+        if action != "remove":
+            if expression is not None:
+                call = functools.partial(inventory.select, expression, [name])
+                await loop.run_in_executor(None, call)
+                if inventory.get(name) is None:
+                    if action == "change":
+                        yield "remove", name  # No longer matching
+                    continue
+            if properties:
+                await probe(inventory, properties, [name])
+        yield action, name
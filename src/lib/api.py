@@ -0,0 +1,112 @@
+"""
+    This module defines the library interface of lsusbblk. USB block devices
+    can be enumerated and queried in-process, the command line is not parsed
+    and nothing is printed.
+
+        import lib.api as lsusbblk
+
+        devices = lsusbblk.enumerate_devices(filter="size>32G")
+        for device in devices.get_devices():
+            print(lsusbblk.select_properties(device, ["device", "serial"]))
+
+        device = lsusbblk.get_device("/dev/sdd")
+        print(lsusbblk.serialise(devices, ["device", "size"]))
+
+    The USB id list is loaded once and shared by all calls of the process.
+
+    api.py
+
+    -*- Mode: Python; coding: utf-8; indent-tabs-mode: t; -*-
+    -*- Mode: Python; c-basic-offset: 4; tab-width: 4 -*-
+
+    ----------------------------------------------------------------------------
+"""
+
+import threading
+
+from lib.filterexpr import parse
+from lib.usbblk import usbblk, usbids
+from lib.usbprop import all_prop
+
+_ids = None
+_ids_lock = threading.Lock()
+
+
+def shared_usbids():
+    """Return the USB id list shared by all calls"""
+    global _ids
+    with _ids_lock:
+        if _ids is None:
+            _ids = usbids()
+        return _ids
+
+
+def properties():
+    """Return list of all device properties"""
+    return list(all_prop)
+
+
+def check_properties(props):
+    """Raise ValueError if any of the properties is unknown"""
+    for prop in props or []:
+        if prop not in all_prop:
+            raise ValueError(f"Unknown property: '{prop}'")
+
+
+def enumerate_devices(
+    human_readable=True, filter=None, jobs=8, timeout=5.0, cache=None, context=None
+):
+    """Return usbblk inventory of attached USB block devices.
+
+    human_readable  present size as 1.2G instead of bytes
+    filter          filter expression, as text or parsed, see lib.filterexpr
+    jobs            number of devices probed in parallel
+    timeout         seconds per probe stage of a device, None waits forever
+    cache           loaded lib.devcache.devicecache to reuse probed values
+    context         pyudev.Context, default a new context
+
+    Properties are probed when first read. Raises ValueError if the filter
+    is invalid.
+    """
+    if isinstance(filter, str):
+        filter = parse(filter)
+    inventory = usbblk(
+        human_readable,
+        shared_usbids(),
+        jobs=jobs,
+        timeout=timeout,
+        cache=cache,
+        context=context,
+    )
+    if filter is not None:
+        inventory.select(filter)
+    return inventory
+
+
+def get_device(name, human_readable=True, timeout=5.0, context=None):
+    """Return usbdevice of device node name, None if not an attached USB disk.
+    Only the given device is looked up, properties are probed when read."""
+    inventory = usbblk(
+        human_readable, shared_usbids(), name, timeout=timeout, context=context
+    )
+    return inventory.get(name)
+
+
+def select_properties(device, props=None):
+    """Return dict of properties, default all, of usbdevice. Raises
+    ValueError if a property is unknown."""
+    check_properties(props)
+    if props is None:
+        return dict(device.get_all())
+    return {prop: device.get(prop) for prop in props}
+
+
+def serialise(inventory, props=None, device=None):
+    """Return JSON of the properties, default all, of the devices of the
+    inventory or of the named device, as displayed by lsusbblk -J. Raises
+    ValueError if a property is unknown or the device is not attached."""
+    check_properties(props)
+    if device is not None and inventory.get(device) is None:
+        raise ValueError(f"Device not found: '{device}'")
+    inventory.probe(props, None if device is None else [device])
+    return inventory.serialise(props, device)
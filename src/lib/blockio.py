@@ -0,0 +1,347 @@
+"""
+    This module defines read only access to block devices. Reads bypass the
+    page cache with O_DIRECT into a page aligned buffer, so what is
+    measured or hashed is what the device delivers.
+
+    The throughput sampler reads a sample at a number of offsets of the
+    device and reports the sequential read throughput in MB/s, 10^6 bytes
+    per second, and the 50th and 99th percentile latency in milliseconds
+    of the individual reads.
+
+    The hash job hashes the first bytes of a number of devices, one thread
+    per device, to verify the devices against the digest of an image.
+
+    blockio.py
+
+    -*- Mode: Python; coding: utf-8; indent-tabs-mode: t; -*-
+    -*- Mode: Python; c-basic-offset: 4; tab-width: 4 -*-
+
+    ----------------------------------------------------------------------------
+"""
+
+import errno
+import hashlib
+import math
+import mmap
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# O_DIRECT requires offsets and lengths aligned to the logical block size
+ALIGN = 4096
+
+# Negotiated speed in Mbps per libusb speed code
+speed_mbps = {1: 1.5, 2: 12, 3: 480, 4: 5000, 5: 10000, 6: 20000}
+
+# Devices delivering less than this part of the negotiated speed are slow
+SLOW_RATIO = 0.1
+
+size_value = re.compile(r"^(\d+)\s*([KMGT]?)(?:i?B)?$", re.IGNORECASE)
+units = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+
+def parse_size(value):
+    """Return size with unit K, M, G or T, counted in 1024, as bytes. Raises
+    ValueError if not a size."""
+    match = size_value.match(value.strip())
+    if match is None:
+        raise ValueError(f"Invalid size: '{value}'")
+    return int(match.group(1)) * units[match.group(2).upper()]
+
+
+def align_down(value):
+    return value - value % ALIGN
+
+
+def align_up(value):
+    return align_down(value + ALIGN - 1)
+
+
+class reader:
+    """Read only O_DIRECT access to a block device. Reads are made into a
+    page aligned buffer of block bytes. Falls back to cached reads where
+    O_DIRECT is not supported."""
+
+    def __init__(self, path, block=1 << 20):
+        self.path = path
+        self.block = align_up(block)
+        self.direct = hasattr(os, "O_DIRECT")
+        try:
+            flags = os.O_RDONLY | (os.O_DIRECT if self.direct else 0)
+            self.fd = os.open(path, flags)
+        except OSError as e:
+            if not self.direct or e.errno != errno.EINVAL:
+                raise
+            self.direct = False
+            self.fd = os.open(path, os.O_RDONLY)
+        self.buffer = mmap.mmap(-1, self.block)  # Anonymous maps are page aligned
+        self.view = memoryview(self.buffer)
+
+    def read(self, offset, length=None):
+        """Read up to length, default block, bytes at offset into the buffer
+        and return the number of bytes read, 0 at the end of the device. The
+        bytes are found in view[:count]."""
+        length = self.block if length is None else min(length, self.block)
+        with self.view[: align_up(length)] as target:
+            count = os.preadv(self.fd, [target], offset)
+        return min(count, length)
+
+    def drop_cache(self):
+        """Drop cached pages of the device when O_DIRECT is not in use"""
+        if not self.direct:
+            os.posix_fadvise(self.fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+    def close(self):
+        if self.fd is not None:
+            self.view.release()
+            self.buffer.close()
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def percentile(values, p):
+    """Return the p percentile of values, nearest rank"""
+    ordered = sorted(values)
+    rank = math.ceil(p / 100 * len(ordered))
+    return ordered[max(0, min(len(ordered), rank) - 1)]
+
+
+class sampler:
+    """Sequential read throughput sampler. sample bytes are read at each
+    offset, given as bytes with unit or as percent of the device size, in
+    reads of block bytes. Devices on the same USB bus share its bandwidth
+    and are sampled one at a time."""
+
+    def __init__(self, sample=8 << 20, offsets="0,50%", block=256 << 10):
+        self.sample = align_up(sample)
+        self.block = align_up(block)
+        self.offsets = [o.strip() for o in offsets.split(",") if o.strip()]
+        if self.sample <= 0 or not self.offsets:
+            raise ValueError("Throughput sample size and offsets are required")
+        for offset in self.offsets:
+            self.offset(offset, 0)  # Validate
+        self.locks = {}
+        self.blocked = set()  # Buses held by readers abandoned on timeout
+        self.lock = threading.Lock()
+
+    def offset(self, offset, size):
+        """Return offset in bytes of an offset given for a device of size"""
+        if offset.endswith("%"):
+            try:
+                percent = float(offset[:-1])
+            except ValueError:
+                raise ValueError(f"Invalid offset: '{offset}'") from None
+            if not 0 <= percent <= 100:
+                raise ValueError(f"Invalid offset: '{offset}'")
+            return int(size * percent / 100)
+        try:
+            return parse_size(offset)
+        except ValueError:
+            raise ValueError(f"Invalid offset: '{offset}'") from None
+
+    def bus_lock(self, bus):
+        """Return lock serialising samples of devices on USB bus"""
+        with self.lock:
+            return self.locks.setdefault(bus, threading.Lock())
+
+    def acquire_bus(self, bus):
+        """Wait for USB bus, return True when it is held by the caller or
+        False if it is held by a reader abandoned on a device that does not
+        respond, waiting for it could take forever"""
+        lock = self.bus_lock(bus)
+        while not lock.acquire(timeout=0.1):
+            with self.lock:
+                if bus in self.blocked:
+                    return False
+        return True
+
+    def release_bus(self, bus, done):
+        """Release USB bus held by the reader of threading.Event done"""
+        with self.lock:
+            done.set()
+            self.blocked.discard(bus)
+            self.locks[bus].release()
+
+    def abandon_bus(self, bus, done):
+        """Mark USB bus blocked if the reader of done still holds it"""
+        with self.lock:
+            if not done.is_set():
+                self.blocked.add(bus)
+
+    def measure(self, path, size, budget=None):
+        """Return dict of throughput "mbs" in MB/s and latency "p50" and
+        "p99" in ms of device path of size bytes, and "complete", False if
+        the samples were not read within budget seconds. The budget is
+        checked between reads, the rates are then of what was read. Raises
+        OSError if the device can not be read."""
+        latencies = []
+        total = 0
+        complete = True
+        deadline = None if budget is None else time.perf_counter() + budget
+        with reader(path, self.block) as device:
+            device.drop_cache()
+            for offset in self.offsets:
+                start = min(align_down(self.offset(offset, size)), size)
+                end = min(start + self.sample, align_down(size))
+                position = max(0, min(start, end - self.sample))
+                while position < end and complete:
+                    t = time.perf_counter()
+                    count = device.read(position, end - position)
+                    latencies.append(time.perf_counter() - t)
+                    if not count:
+                        break
+                    total += count
+                    position += count
+                    complete = deadline is None or time.perf_counter() < deadline
+
+        elapsed = sum(latencies)
+        if not total or not elapsed:
+            raise OSError(errno.EIO, f"Nothing read from {path}")
+        return {
+            "mbs": total / elapsed / 1e6,
+            "p50": percentile(latencies, 50) * 1000,
+            "p99": percentile(latencies, 99) * 1000,
+            "complete": complete,
+        }
+
+
+class hashjob:
+    """Hash of the first bytes of block devices. Each device is read by its
+    own thread, devices on separate USB ports do not wait for each other,
+    in large reads so that the thread spends its time in the kernel and
+    hashlib, both without holding the GIL."""
+
+    def __init__(self, targets, algorithm="sha256", block=4 << 20):
+        """targets is a dict of device path and number of bytes to hash"""
+        self.targets = targets
+        self.algorithm = algorithm
+        self.block = block
+        hashlib.new(algorithm)  # Raises ValueError if not supported
+        self.done = dict.fromkeys(targets, 0)
+
+    def hash(self, path):
+        """Return hex digest of the first bytes of device path. Raises OSError
+        if the device could not be read or is shorter."""
+        digest = hashlib.new(self.algorithm)
+        limit = self.targets[path]
+        position = 0
+        with reader(path, self.block) as device:
+            device.drop_cache()  # Verify the device, not the page cache
+            while position < limit:
+                count = device.read(position, limit - position)
+                if not count:
+                    raise OSError(errno.EIO, f"{path} ends at {position} bytes")
+                digest.update(device.view[:count])
+                position += count
+                self.done[path] = position
+        return digest.hexdigest()
+
+    def run(self, progress=None, interval=1.0):
+        """Hash all devices and return dict of device path and hex digest, or
+        the OSError raised. progress, if given, is called every interval
+        seconds, and when done, with bytes hashed, bytes to hash, devices
+        done and number of devices."""
+        results = {}
+        if not self.targets:
+            return results
+        total = sum(self.targets.values())
+        with ThreadPoolExecutor(max_workers=len(self.targets)) as pool:
+            futures = {pool.submit(self.hash, path): path for path in self.targets}
+            pending = set(futures)
+            while pending:
+                finished, pending = wait(pending, timeout=interval)
+                for future in finished:
+                    try:
+                        results[futures[future]] = future.result()
+                    except OSError as e:
+                        results[futures[future]] = e
+                if progress is not None:
+                    done = sum(self.done.values())
+                    progress(done, total, len(results), len(self.targets))
+        return results
+
+
+class progressline:
+    """Progress of a hash job written to a stream, default standard error,
+    overwritten in place on a terminal"""
+
+    def __init__(self, stream=None):
+        self.stream = sys.stderr if stream is None else stream
+        self.start = time.monotonic()
+        self.inplace = self.stream.isatty()
+
+    def __call__(self, done, total, finished, count):
+        elapsed = max(time.monotonic() - self.start, 1e-9)
+        line = (
+            f"{done / 1e6:.1f} of {total / 1e6:.1f} MB, "
+            f"{done / elapsed / 1e6:.1f} MB/s, {finished} of {count} devices done"
+        )
+        if self.inplace:
+            end = "\n" if finished == count else ""
+            print("\r" + line + "\033[K", end=end, file=self.stream, flush=True)
+        else:
+            print(line, file=self.stream, flush=True)
+
+
+def is_slow(mbs, speed):
+    """Return True if mbs, measured MB/s, is far below what the negotiated
+    libusb speed code allows, None if the speed is not known"""
+    mbps = speed_mbps.get(speed)
+    if mbps is None:
+        return None
+    return mbs < mbps / 8 * SLOW_RATIO
+
+
+if __name__ == "__main__":
+
+    import tempfile
+
+    assert parse_size("8M") == 8 << 20  # nosec B101
+    assert percentile([3, 1, 2, 4], 50) == 2  # nosec B101
+    assert percentile(list(range(1, 101)), 99) == 99  # nosec B101
+    assert is_slow(5.0, 3) and not is_slow(30.0, 3)  # nosec B101
+    assert is_slow(5.0, 0) is None  # nosec B101
+
+    with tempfile.NamedTemporaryFile(dir=".") as f:
+        f.write(os.urandom(4 << 20))
+        f.flush()
+        s = sampler(1 << 20, "0,50%, 3M", 64 << 10)
+        result = s.measure(f.name, 4 << 20)
+        assert result["mbs"] > 0 and result["p99"] >= result["p50"]  # nosec B101
+        assert result["complete"]  # nosec B101
+        assert not s.measure(f.name, 4 << 20, budget=0)["complete"]  # nosec B101
+        done = threading.Event()
+        assert s.acquire_bus("1")  # nosec B101
+        s.abandon_bus("1", done)
+        assert not s.acquire_bus("1")  # nosec B101
+        s.release_bus("1", done)
+        assert s.acquire_bus("1")  # nosec B101
+        with reader(f.name, 1000) as r:
+            assert r.read(0, 1000) == 1000  # nosec B101
+            assert r.read(4 << 20) == 0  # nosec B101
+        job = hashjob({f.name: 3 << 20, "/nonexistent": 1})
+        results = job.run()
+        with open(f.name, "rb") as image:
+            expected = hashlib.sha256(image.read(3 << 20)).hexdigest()
+        assert results[f.name] == expected  # nosec B101
+        assert isinstance(results["/nonexistent"], OSError)  # nosec B101
+        results = hashjob({f.name: 5 << 20}).run()  # Longer than the file
+        assert isinstance(results[f.name], OSError)  # nosec B101
+    for invalid in ["", "x", "101%", "1Q"]:
+        try:
+            sampler(offsets=invalid)
+            raise AssertionError(invalid)
+        except ValueError:
+            pass
+
+    print(f"Class {s.__class__.__name__} completed test successfully")
@@ -40,10 +40,33 @@ class conf:
     verbose: bool = False
     scientific: bool = False
     json: bool = False
+    ndjson: bool = False
     monochrome: bool = False
     debug: bool = False
+    timings: bool = False
+    sequential: bool = False
+    no_cache: bool = False
+    flush_cache: bool = False
+    daemon: bool = False
     device: str | None = None
     properties: str | None = None
+    filter: str | None = None
+    jobs: int = 8
+    timeout: float = 5.0
+    count: int = 1
+    settle: float = 0.0
+    deadline: float = 0.0
+    throughput: bool = False
+    sample: str = "8M"
+    offsets: str = "0,50%"
+    verify: bool = False
+    bytes: str | None = None
+    expect: str | None = None
+    stats: bool = False
+    interval: float = 1.0
+    samples: int = 0
+    watch: bool = False
+    argv: "list[str] | None" = None  # Default sys.argv[1:]
 
     def __post_init__(self):
         """Customised command line configuration"""
@@ -62,6 +85,10 @@ class conf:
         add("-N", "--nodevices", help="Number of devices", action="store_true")
         add("-u", "--usblist", help="Download USB id list", action="store_true")
         add("-f", "--follow", help="Wait for new device", action="store_true")
+        add("-w", "--watch", help="Keep devices updated on screen", action="store_true")
+        add("--no-cache", help="Do not use the device cache", action="store_true")
+        add("--flush-cache", help="Clear the device cache", action="store_true")
+        add("--daemon", help="Serve devices to other invocations", action="store_true")
 
         # Presentation switches
         pre = ap.add_argument_group("presentation switches")
@@ -71,16 +98,84 @@ class conf:
         add("-v", "--verbose", help="Verbose output", action="store_true")
         add("-s", "--scientific", help="Non-human friendly", action="store_true")
         add("-J", "--json", help="Display out in JSON", action="store_true")
+        add("--ndjson", help="Display one JSON line per device", action="store_true")
         add("-M", "--monochrome", help="Display monochrome text", action="store_true")
         add("--debug", "-d", help="Debug", action="store_true")
+        add("--timings", help="Report time spent per phase", action="store_true")
+        add("-S", "--sequential", help="Probe devices one by one", action="store_true")
 
         prv = ap.add_argument_group("presentation values")
         add = prv.add_argument
         add("-D", "--device", help="Display device", type=str)
         add("-p", "--properties", help="List of properties to display", type=str)
+        add("-F", "--filter", help="Display devices matching expression", type=str)
+        add(
+            "-j",
+            "--jobs",
+            help="Number of devices probed in parallel",
+            type=int,
+            default=8,
+        )
+        add(
+            "-t",
+            "--timeout",
+            help="Seconds per device probe stage, 0 waits forever",
+            type=float,
+            default=5.0,
+        )
+
+        fol = ap.add_argument_group("follow values")
+        add = fol.add_argument
+        add(
+            "-c",
+            "--count",
+            help="Number of new devices to wait for",
+            type=int,
+            default=1,
+        )
+        add(
+            "--settle",
+            help="Seconds to collect further devices",
+            type=float,
+            default=0.0,
+        )
+        add(
+            "--deadline",
+            help="Seconds to wait, 0 waits forever",
+            type=float,
+            default=0.0,
+        )
+
+        thr = ap.add_argument_group("throughput values")
+        add = thr.add_argument
+        add("--throughput", help="Measure read throughput", action="store_true")
+        add("--sample", help="Bytes read at each offset", type=str, default="8M")
+        add(
+            "--offsets",
+            help="Offsets read, bytes or percent",
+            type=str,
+            default="0,50%",
+        )
+
+        ver = ap.add_argument_group("verify values")
+        add = ver.add_argument
+        add("--verify", help="Hash devices in parallel", action="store_true")
+        add("--bytes", help="Bytes hashed, default whole device", type=str)
+        add("--expect", help="Expected sha256 digest", type=str)
+
+        sta = ap.add_argument_group("statistics values")
+        add = sta.add_argument
+        add("--stats", help="Display I/O statistics", action="store_true")
+        add("--interval", help="Seconds between statistics", type=float, default=1.0)
+        add(
+            "--samples",
+            help="Statistics displayed, 0 until stopped",
+            type=int,
+            default=0,
+        )
 
         # Do the actual argument parsing and store the result
-        args = ap.parse_args()
+        args = ap.parse_args(self.argv)
 
         # store the parsed arguments in the dataclass
         for key, value in vars(args).items():
@@ -0,0 +1,126 @@
+"""
+    This module defines the daemon that keeps an inventory of USB block
+    devices updated from udev events and serves it over a Unix socket, and
+    the client used to query it.
+
+    A query is one JSON line with the keys "properties", "device" and
+    "human_readable". The answer is one line with the JSON produced by
+    usbblk.serialise, or an empty line if the device is not attached.
+
+    daemon.py
+
+    -*- Mode: Python; coding: utf-8; indent-tabs-mode: t; -*-
+    -*- Mode: Python; c-basic-offset: 4; tab-width: 4 -*-
+
+    ----------------------------------------------------------------------------
+"""
+
+import json
+import os
+import socket
+
+from lib.devcache import runtime_dir
+
+
+def socket_path():
+    """Return path of the daemon socket"""
+    return os.path.join(runtime_dir(), "daemon.sock")
+
+
+def query(properties=None, device=None, human_readable=True, path=None, timeout=2.0):
+    """Ask the daemon for the serialised inventory. Returns the JSON string or
+    None if the daemon is not running or could not answer."""
+    request = {
+        "properties": properties,
+        "device": device,
+        "human_readable": human_readable,
+    }
+    try:
+        path = socket_path() if path is None else path
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(timeout)
+            client.connect(path)
+            client.sendall(json.dumps(request).encode() + b"\n")
+            answer = client.makefile("rb").readline().decode().rstrip("\n")
+    except (OSError, ValueError):
+        return None
+    return answer or None
+
+
+def is_running(path):
+    """Return True if a daemon answers on socket path"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(path)
+            return True
+        except OSError:
+            return False
+
+
+def answer(inventory, line):
+    """Return answer to query line"""
+    try:
+        request = json.loads(line)
+        properties = request.get("properties")
+        device = request.get("device")
+        human_readable = bool(request.get("human_readable", True))
+    except (ValueError, AttributeError):
+        return ""
+
+    if device is not None and inventory.get(device) is None:
+        return ""
+    inventory.set_human_readable(human_readable)
+    try:
+        return inventory.serialise(properties, device)
+    except ValueError:
+        return ""  # Unknown property
+
+
+def serve(inventory, path=None, timeout=2.0):
+    """Serve inventory, an usbblk, on Unix socket path until interrupted.
+    The inventory is updated from udev events and new devices are probed
+    as soon as they are attached."""
+    import selectors
+
+    path = socket_path() if path is None else path
+    if is_running(path):
+        raise RuntimeError(f"Daemon already running on {path}")
+    if os.path.exists(path):
+        os.remove(path)  # Left by a daemon that was killed
+
+    inventory.start_monitor()
+    inventory.pending.clear()  # Already part of the inventory
+    inventory.probe()
+
+    selector = selectors.DefaultSelector()
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        server.bind(path)
+        os.chmod(path, 0o600)
+        server.listen()
+        selector.register(server, selectors.EVENT_READ, "client")
+        selector.register(inventory.monitor, selectors.EVENT_READ, "udev")
+
+        while True:
+            for key, _ in selector.select():
+                if key.data == "udev":
+                    while (device := inventory.monitor.poll(0)) is not None:
+                        event = inventory.handle_event(device)
+                        if event is not None and event[0] in ("add", "change"):
+                            inventory.probe(None, [event[1]])
+                    inventory.save_cache()
+                else:
+                    connection, _ = server.accept()
+                    with connection:
+                        try:
+                            connection.settimeout(timeout)
+                            line = connection.makefile("rb").readline()
+                            reply = answer(inventory, line.decode())
+                            connection.sendall(reply.encode() + b"\n")
+                        except (OSError, UnicodeDecodeError):
+                            pass  # Client gone, serve the next
+    finally:
+        selector.close()
+        server.close()
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,174 @@
+"""
+    This module defines the persistent inventory cache of probed USB block
+    devices. Probed values of a device are kept as long as the device stays
+    attached and are shared by concurrent invocations.
+
+    devcache.py
+
+    -*- Mode: Python; coding: utf-8; indent-tabs-mode: t; -*-
+    -*- Mode: Python; c-basic-offset: 4; tab-width: 4 -*-
+
+    ----------------------------------------------------------------------------
+"""
+
+import fcntl
+import json
+import os
+import stat
+import tempfile
+from contextlib import contextmanager
+
+
+def runtime_dir():
+    """Return private runtime directory, $XDG_RUNTIME_DIR/lsusbblk. Raises
+    PermissionError if the directory is not a directory owned by the user
+    with mode 0700, e.g. created by another user in the shared /tmp."""
+    base = os.environ.get("XDG_RUNTIME_DIR")
+    if base:
+        path = os.path.join(base, "lsusbblk")
+    else:
+        path = os.path.join(tempfile.gettempdir(), f"lsusbblk-{os.getuid()}")
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+
+    info = os.lstat(path)  # A symbolic link is refused
+    if (
+        not stat.S_ISDIR(info.st_mode)
+        or info.st_uid != os.getuid()
+        or stat.S_IMODE(info.st_mode) != 0o700
+    ):
+        raise PermissionError(f"Runtime directory {path} is not private")
+    return path
+
+
+def device_identity(device):
+    """Return cache key of udev device. USEC_INITIALIZED changes each time a
+    device is attached, so a replaced device never matches a cached one."""
+    get = device.properties.get
+    names = ["DEVNAME", "MAJOR", "MINOR", "USEC_INITIALIZED"]
+    return ":".join(str(get(name)) for name in names)
+
+
+class devicecache:
+    """Inventory cache stored as JSON in the runtime directory. Readers take a
+    shared lock and writers an exclusive lock on a separate lock file."""
+
+    version = 1
+
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+        self.updated = {}
+
+        if self.path is None:
+            try:
+                self.path = os.path.join(runtime_dir(), "inventory.json")
+            except OSError:
+                self.path = None  # No runtime directory, nothing is cached
+
+    @contextmanager
+    def _lock(self, mode):
+        with open(self.path + ".lock", "a") as lock:
+            fcntl.flock(lock.fileno(), mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+    def _read(self):
+        """Return cached entries, empty if no or unreadable cache file"""
+        try:
+            with open(self.path) as f:
+                content = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(content, dict) or content.get("version") != self.version:
+            return {}
+        return content.get("devices", {})
+
+    def load(self):
+        """Read the cache file"""
+        if self.path is None:
+            return self
+        try:
+            with self._lock(fcntl.LOCK_SH):
+                self.entries = self._read()
+        except OSError:
+            self.entries = {}
+        return self
+
+    def lookup(self, key):
+        """Return cached values of device or None"""
+        return self.entries.get(key)
+
+    def store(self, key, values):
+        """Store values of device, written by save()"""
+        if values and values != self.entries.get(key):
+            self.updated[key] = values
+
+    def save(self, present=None):
+        """Merge stored values into the cache file. If present, the keys of all
+        attached devices, is given then entries of detached devices are
+        dropped."""
+        if self.path is None or (not self.updated and present is None):
+            return
+        try:
+            with self._lock(fcntl.LOCK_EX):
+                current = self._read()
+                entries = dict(current, **self.updated)
+                if present is not None:
+                    entries = {k: v for k, v in entries.items() if k in present}
+                if entries == current:
+                    return
+                directory, name = os.path.split(self.path)
+                fd, tmp = tempfile.mkstemp(prefix=name + ".", dir=directory)
+                try:
+                    with os.fdopen(fd, "w") as f:
+                        json.dump({"version": self.version, "devices": entries}, f)
+                    os.replace(tmp, self.path)
+                except OSError:
+                    os.remove(tmp)
+                    raise
+                self.entries = entries
+                self.updated = {}
+        except OSError:
+            pass  # The cache is only an optimisation
+
+    def flush(self):
+        """Remove the cache file"""
+        self.entries = {}
+        self.updated = {}
+        if self.path is None:
+            return
+        try:
+            with self._lock(fcntl.LOCK_EX):
+                os.remove(self.path)
+        except OSError:
+            pass  # No cache file
+
+
+if __name__ == "__main__":
+
+    path = os.path.join(tempfile.mkdtemp(), "inventory.json")
+    cache = devicecache(path).load()
+    assert cache.lookup("/dev/sdb:8:16:1") is None  # nosec B101
+    cache.store("/dev/sdb:8:16:1", {"usbver": "USB 3.2"})
+    cache.save()
+    cache = devicecache(path).load()
+    assert cache.lookup("/dev/sdb:8:16:1") == {"usbver": "USB 3.2"}  # nosec B101
+    cache.save(present=set())
+    assert devicecache(path).load().lookup("/dev/sdb:8:16:1") is None  # nosec B101
+    cache.flush()
+    assert not os.path.exists(path)  # nosec B101
+
+    os.environ["XDG_RUNTIME_DIR"] = tempfile.mkdtemp()
+    os.chmod(runtime_dir(), 0o755)
+    try:
+        runtime_dir()
+        raise AssertionError("Shared runtime directory accepted")
+    except PermissionError:
+        pass
+
+    print(f"Class {cache.__class__.__name__} completed test successfully")
@@ -0,0 +1,269 @@
+"""
+    This module defines the filter expressions used to select devices.
+
+        expression := term ( ("or" | "||") term )*
+        term       := factor ( ("and" | "&&") factor )*
+        factor     := ("not" | "!") factor | "(" expression ")" | compare
+        compare    := property operator value
+        operator   := "=" | "==" | "!=" | "<" | "<=" | ">" | ">=" | "~"
+
+    Values are words or quoted strings. Sizes may be given with the units
+    K, M, G, T and P, counted in 1024, e.g. size>32G. The USB version is
+    compared as a number, e.g. usbver>=3. "~" is a regular expression
+    search. Other values are compared as numbers if both sides are numbers
+    and else as strings.
+
+    An expression can be evaluated with only the properties found in the
+    udev database. The result is then True, False or None if it depends on
+    properties not yet probed, so that devices can be dropped before the
+    expensive probes are made.
+
+    filterexpr.py
+
+    -*- Mode: Python; coding: utf-8; indent-tabs-mode: t; -*-
+    -*- Mode: Python; c-basic-offset: 4; tab-width: 4 -*-
+
+    ----------------------------------------------------------------------------
+"""
+
+import operator
+import re
+
+from lib.usbprop import all_prop, udev_prop
+
+# Properties known without probing the device
+cheap_prop = set(udev_prop) | {"id"}
+
+units = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40, "P": 1 << 50}
+
+operators = {
+    "=": operator.eq,
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+token = re.compile(
+    r"""\s*(?:
+        (?P<paren>[()])
+      | (?P<op>==|!=|<=|>=|=|<|>|~)
+      | (?P<logic>&&|\|\||!)
+      | "(?P<dquoted>[^"]*)"
+      | '(?P<squoted>[^']*)'
+      | (?P<word>[^\s()<>=!~&|"']+)
+    )""",
+    re.VERBOSE,
+)
+
+size_value = re.compile(r"^(\d+(?:\.\d+)?)\s*([KMGTP]?)(?:i?B)?$", re.IGNORECASE)
+
+
+def tokenize(text):
+    """Return list of tokens, tuples (kind, value)"""
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = token.match(text, position)
+        if match is None:
+            raise ValueError(f"Invalid filter at: '{text[position:]}'")
+        position = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind in ("dquoted", "squoted"):
+            kind = "value"
+        elif kind == "word" and value.lower() in ("and", "or", "not"):
+            kind, value = "logic", value.lower()
+        tokens.append((kind, value))
+    return tokens
+
+
+def number(value):
+    """Return value as float, None if not a number"""
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def parse_size(value):
+    """Return size with unit as bytes, None if not a size"""
+    match = size_value.match(value)
+    if match is None:
+        return None
+    return float(match.group(1)) * units[match.group(2).upper()]
+
+
+class compare:
+    """Comparison of a property with a value"""
+
+    def __init__(self, prop, op, value):
+        self.prop = prop
+        self.op = op
+        self.value = value
+        self.properties = {prop}
+
+        if op == "~":
+            try:
+                self.regexp = re.compile(value)
+            except re.error as e:
+                raise ValueError(f"Invalid regular expression '{value}': {e}")
+        elif prop == "size":
+            self.number = parse_size(value)
+            if self.number is None:
+                raise ValueError(f"Invalid size: '{value}'")
+        elif prop == "usbver":
+            self.number = number(value.upper().replace("USB", "").strip())
+        else:
+            self.number = number(value)
+
+    def actual(self, device):
+        """Return property value of device, size in bytes and USB version as
+        numbers, None if not known"""
+        value = device.get(self.prop)
+        if value == "?":
+            return None
+        if self.prop == "size":
+            return device.raw_size
+        if self.prop == "usbver":
+            return number(value.replace("USB", "").strip())
+        return value
+
+    def evaluate(self, device, cheap=False):
+        if cheap and self.prop not in cheap_prop:
+            return None
+        value = self.actual(device)
+        if self.op == "~":
+            return value is not None and self.regexp.search(str(value)) is not None
+        if value is None:
+            return self.op == "!="
+
+        if self.number is not None:
+            actual = value if isinstance(value, (int, float)) else number(value)
+            if actual is not None:
+                return operators[self.op](actual, self.number)
+        return operators[self.op](str(value), self.value)
+
+
+class logic:
+    """Logical combination of expressions"""
+
+    def __init__(self, op, operands):
+        self.op = op
+        self.operands = operands
+        self.properties = set().union(*(o.properties for o in operands))
+
+    def evaluate(self, device, cheap=False):
+        results = [o.evaluate(device, cheap) for o in self.operands]
+        if self.op == "not":
+            return None if results[0] is None else not results[0]
+        decisive = self.op == "or"  # True decides or, False decides and
+        if decisive in results:
+            return decisive
+        if None in results:
+            return None
+        return not decisive
+
+
+class parser:
+    """Recursive descent parser of filter expressions"""
+
+    def __init__(self, text):
+        self.tokens = tokenize(text)
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def next(self):
+        current = self.peek()
+        if current[0] is None:
+            raise ValueError("Unexpected end of filter")
+        self.position += 1
+        return current
+
+    def parse(self):
+        expression = self.expression()
+        if self.peek()[0] is not None:
+            raise ValueError(f"Unexpected '{self.peek()[1]}' in filter")
+        return expression
+
+    def expression(self):
+        operands = [self.term()]
+        while self.peek() in (("logic", "or"), ("logic", "||")):
+            self.next()
+            operands.append(self.term())
+        return operands[0] if len(operands) == 1 else logic("or", operands)
+
+    def term(self):
+        operands = [self.factor()]
+        while self.peek() in (("logic", "and"), ("logic", "&&")):
+            self.next()
+            operands.append(self.factor())
+        return operands[0] if len(operands) == 1 else logic("and", operands)
+
+    def factor(self):
+        kind, value = self.next()
+        if (kind, value) in (("logic", "not"), ("logic", "!")):
+            return logic("not", [self.factor()])
+        if (kind, value) == ("paren", "("):
+            expression = self.expression()
+            if self.next() != ("paren", ")"):
+                raise ValueError("Missing ')' in filter")
+            return expression
+        if kind != "word":
+            raise ValueError(f"Expected property, found '{value}'")
+        if value not in all_prop:
+            raise ValueError(f"Unknown property: '{value}'")
+
+        op_kind, op = self.next()
+        if op_kind != "op":
+            raise ValueError(f"Expected comparison after '{value}', found '{op}'")
+        value_kind, compared = self.next()
+        if value_kind not in ("word", "value"):
+            raise ValueError(f"Expected value after '{value} {op}'")
+        return compare(value, op, compared)
+
+
+def parse(text):
+    """Return expression parsed from text, raises ValueError if invalid"""
+    return parser(text).parse()
+
+
+if __name__ == "__main__":
+
+    class device:
+        raw_size = 64 << 30
+
+        def get(self, key):
+            values = {
+                "vid": "0781", "pid": "5581", "usbver": "USB 3.2", "size": "64.0G"
+            }
+            return values.get(key, "?")
+
+    d = device()
+    assert parse("vid=0781").evaluate(d)  # nosec B101
+    assert parse("vid=0781 and size>32G").evaluate(d, cheap=True) is None  # nosec B101
+    assert parse("vid=0b05 and size>32G").evaluate(d, cheap=True) is False  # nosec B101
+    assert parse("vid=0781 and size>32G and usbver>=3").evaluate(d)  # nosec B101
+    assert not parse("size<=32GiB").evaluate(d)  # nosec B101
+    assert parse("not (pid=1 or pid='5581x') && vid ~ '^07'").evaluate(d)  # nosec B101
+    assert parse("vid=1 or size>1M").evaluate(d, cheap=True) is None  # nosec B101
+    assert parse("vid=0781 or size>1M").evaluate(d, cheap=True)  # nosec B101
+    assert parse("label != x").evaluate(d)  # nosec B101
+    assert parse("status=timeout").evaluate(d, cheap=True) is None  # nosec B101
+    d.get = lambda key: "timeout"
+    assert parse("status=timeout").evaluate(d)  # nosec B101
+    for invalid in ["vid", "vid=", "nosuch=1", "(vid=1", "vid=1 pid=2", "size>big"]:
+        try:
+            parse(invalid)
+            raise AssertionError(invalid)
+        except ValueError:
+            pass
+
+    print("Filter expressions completed test successfully")
@@ -0,0 +1,156 @@
+"""
+    This module defines the I/O statistics of USB block devices, sampled
+    from the stat file of each device in sysfs, see the kernel
+    Documentation/block/stat.rst. The stat files are kept open and read with
+    pread, a sample of a device costs a single system call.
+
+    Rates are computed from two samples, throughput in MB/s, 10^6 bytes
+    per second, requests per second, requests in flight and the percentage
+    of the time the device was busy.
+
+    iostat.py
+
+    -*- Mode: Python; coding: utf-8; indent-tabs-mode: t; -*-
+    -*- Mode: Python; c-basic-offset: 4; tab-width: 4 -*-
+
+    ----------------------------------------------------------------------------
+"""
+
+import os
+import time
+
+# Fields of the stat file used, in order
+R_IOS, R_SECTORS, W_IOS, W_SECTORS, IN_FLIGHT, IO_TICKS = 0, 2, 4, 6, 8, 9
+
+# The stat file always counts in 512 byte sectors
+SECTOR = 512
+
+columns = ["device", "r_mbs", "w_mbs", "r_iops", "w_iops", "inflight", "util"]
+
+
+class statfile:
+    """Stat file of a block device, kept open"""
+
+    def __init__(self, sys_path):
+        self.fd = os.open(os.path.join(sys_path, "stat"), os.O_RDONLY)
+
+    def read(self):
+        """Return the fields of the stat file as integers"""
+        return [int(value) for value in os.pread(self.fd, 512, 0).split()]
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class iostat:
+    """I/O statistics of a set of block devices"""
+
+    def __init__(self):
+        self.files = {}
+        self.previous = {}
+
+    def add(self, name, sys_path):
+        """Start sampling device name with sysfs directory sys_path. Devices
+        without a readable stat file are left out."""
+        try:
+            self.files[name] = statfile(sys_path)
+        except OSError:
+            return
+        self.previous[name] = (time.monotonic(), self.files[name].read())
+
+    def remove(self, name):
+        """Stop sampling device name"""
+        self.previous.pop(name, None)
+        stat = self.files.pop(name, None)
+        if stat is not None:
+            stat.close()
+
+    def close(self):
+        for name in list(self.files):
+            self.remove(name)
+
+    def sample(self):
+        """Return list of rows, dicts with the columns, of the devices in
+        name order with rates since the previous sample"""
+        rows = []
+        for name in sorted(self.files):
+            now = time.monotonic()
+            try:
+                current = self.files[name].read()
+            except (OSError, ValueError):
+                continue  # Removed, the udev event is still to come
+            then, previous = self.previous[name]
+            self.previous[name] = (now, current)
+            rows.append(rates(name, previous, current, now - then))
+        return rows
+
+
+def rates(name, previous, current, seconds):
+    """Return row of rates between two samples of the stat file"""
+    seconds = max(seconds, 1e-9)
+
+    def delta(field):
+        return max(0, current[field] - previous[field])  # Reset on reattach
+
+    return {
+        "device": name,
+        "r_mbs": f"{delta(R_SECTORS) * SECTOR / seconds / 1e6:.2f}",
+        "w_mbs": f"{delta(W_SECTORS) * SECTOR / seconds / 1e6:.2f}",
+        "r_iops": f"{delta(R_IOS) / seconds:.1f}",
+        "w_iops": f"{delta(W_IOS) / seconds:.1f}",
+        "inflight": str(current[IN_FLIGHT]),
+        "util": f"{min(100.0, delta(IO_TICKS) / 10 / seconds):.1f}",
+    }
+
+
+def run(inventory, interval, report, samples=0, expression=None):
+    """Sample the devices of inventory, an usbblk, every interval seconds
+    and pass the rows to report. Devices attached meanwhile, and matching
+    the filter expression if given, are added from udev events, which are
+    waited for between the samples. Stops after samples reports unless 0."""
+    stats = iostat()
+    try:
+        for name in inventory.get_device_list():
+            stats.add(name, inventory.get(name).udev.sys_path)
+
+        count = 0
+        tick = time.monotonic() + interval
+        while samples == 0 or count < samples:
+            left = tick - time.monotonic()
+            if left > 0:
+                event = inventory.wait_event(left)
+                if event is not None:
+                    action, name = event
+                    if action == "remove":
+                        stats.remove(name)
+                    elif expression is not None and action == "add":
+                        inventory.select(expression, [name])
+                    if action != "remove" and inventory.get(name) is not None:
+                        stats.remove(name)
+                        stats.add(name, inventory.get(name).udev.sys_path)
+                continue
+
+            report(stats.sample())
+            count += 1
+            tick = max(tick + interval, time.monotonic())  # Skip missed ticks
+    finally:
+        stats.close()
+
+
+if __name__ == "__main__":
+
+    previous = [10, 0, 2048, 5, 0, 0, 0, 0, 0, 100, 100]
+    current = [110, 0, 4096, 50, 20, 0, 1024, 10, 3, 600, 700]
+    row = rates("/dev/sdb", previous, current, 1.0)
+    assert row["r_mbs"] == "1.05" and row["w_mbs"] == "0.52"  # nosec B101
+    assert row["r_iops"] == "100.0" and row["w_iops"] == "20.0"  # nosec B101
+    assert row["inflight"] == "3" and row["util"] == "50.0"  # nosec B101
+    assert list(row) == columns  # nosec B101
+
+    s = iostat()
+    s.add("missing", "/nonexistent")
+    assert s.sample() == []  # nosec B101
+
+    print(f"Class {s.__class__.__name__} completed test successfully")
@@ -1,9 +1,17 @@
-from functools import partial
+from functools import cache, partial
 import shutil
-from colorama import Fore
+import sys
 import typing
 
 
+@cache
+def fore():
+    """colorama is loaded on first use of colour"""
+    from colorama import Fore
+
+    return Fore
+
+
 class formated_print:
 
     def __init__(self, mono: bool = False, quiet: bool = False):
@@ -43,40 +51,82 @@ class formated_print:
 
     def p(self, line):
         """Print line unless line empty"""
+        if line != "":
+            print(self.fit(line))
+
+    def fit(self, line):
+        """Return line shortened to the terminal width"""
 
         # Minimum resulting line length is 64 character
         dots = " ... "
         l_size = max(int((self.columns - len(dots)) / 1), 30)
         r_size = max(self.columns - l_size - len(dots), 29)
-        if line != "":
-            if len(line) <= self.columns:
-                print(line)
-            else:
-                # if terminal is to narrow shorten line
-                print(line[:l_size] + dots + line[-r_size:])
+        if len(line) <= self.columns:
+            return line
+        else:
+            # if terminal is to narrow shorten line
+            return line[:l_size] + dots + line[-r_size:]
+
+    def layout(self, header, rows):
+        """Return column widths, the widest value or header of each column"""
+        widths = [len(h) for h in header]
+        for row in rows:
+            widths = [max(w, len(v)) for w, v in zip(widths, row)]
+        return widths
+
+    def table_lines(self, header, rows):
+        """Return lines of table of rows, lists of column values, with a
+        header line and a divider line. Column widths are computed once and
+        the lines are formatted using one precomputed template per line
+        type."""
+        widths = self.layout(header, rows)
+        line = "".join("{:<" + str(w) + "} | " for w in widths)
+        divider = "".join("{:<" + str(w) + "} + " for w in widths)
+
+        lines = [" ", line.format(*header)]
+        lines.append(divider.format(*["-" * w for w in widths]))
+        for row in rows:
+            lines.append(line.format(*row))
+        lines.append(" ")
+        return lines
+
+    def format_table(self, header, rows):
+        """Return table of rows fitted to the terminal width"""
+        lines = self.table_lines(header, rows)
+        if self.mono:
+            lines = [self.fit(ln) for ln in lines]
+        else:
+            lines = [self.green(self.fit(ln)) for ln in lines]
+        return "\n".join(lines) + "\n"
+
+    def table(self, header, rows):
+        """Print table with a single write"""
+        if not self.quiet:
+            sys.stdout.write(self.format_table(header, rows))
+            sys.stdout.flush()
 
     """ colour control """
 
     def blue(self, line):
-        return Fore.BLUE + line + Fore.RESET
+        return fore().BLUE + line + fore().RESET
 
     def red(self, line):
-        return Fore.RED + line + Fore.RESET
+        return fore().RED + line + fore().RESET
 
     def green(self, line):
-        return Fore.GREEN + line + Fore.RESET
+        return fore().GREEN + line + fore().RESET
 
     def yellow(self, line):
-        return Fore.YELLOW + line + Fore.RESET
+        return fore().YELLOW + line + fore().RESET
 
     def magenta(self, line):
-        return Fore.MAGENTA + line + Fore.RESET
+        return fore().MAGENTA + line + fore().RESET
 
     def cyan(self, line):
-        return Fore.CYAN + line + Fore.RESET
+        return fore().CYAN + line + fore().RESET
 
     def reset(self, line):
-        return Fore.RESET + line
+        return fore().RESET + line
 
     # def quiet(self, line):
     #     """if quiet return empty string"""
@@ -114,6 +164,62 @@ class formated_print:
         )
 
 
+class tableview:
+    """Table kept on screen and updated in place. The lines of the table are
+    compared with those on screen and only lines that changed are written,
+    the cursor is moved over the others with ANSI cursor movements relative
+    to the line after the table. Lines are cut at the terminal width, as
+    the movements count lines and a wrapped line would be counted as one.
+    A table taller than the terminal is redrawn in full. Each update is a
+    single write. Streams that are not terminals get the full table on
+    each update."""
+
+    def __init__(self, op, stream=None):
+        self.op = op
+        self.stream = sys.stdout if stream is None else stream
+        self.inplace = self.stream.isatty()
+        self.lines = []
+        self.tall = False
+
+    def update(self, header, rows):
+        """Show table of rows, lists of column values, with header"""
+        if not self.inplace:
+            self.stream.write(self.op.format_table(header, rows))
+            self.stream.flush()
+            return
+
+        columns, height = shutil.get_terminal_size()
+        lines = [ln[:columns] for ln in self.op.table_lines(header, rows)]
+        if not self.op.mono:
+            lines = [self.op.green(ln) for ln in lines]
+
+        out = []
+        tall = len(lines) >= height
+        if tall or self.tall or len(self.lines) >= height:
+            out.append("\033[H\033[2J")  # Out of reach, redraw from the top
+            out.extend(ln + "\n" for ln in lines)
+        else:
+            if self.lines:
+                out.append(f"\033[{len(self.lines)}F")  # First line of the table
+            skip = 0
+            for i, line in enumerate(lines):
+                if i < len(self.lines) and self.lines[i] == line:
+                    skip += 1
+                    continue
+                if skip:
+                    out.append(f"\033[{skip}E")
+                    skip = 0
+                out.append("\033[2K" + line + "\n")  # A full width line stays
+            if skip:
+                out.append(f"\033[{skip}E")
+            if len(lines) < len(self.lines):
+                out.append("\033[J")  # Clear the lines of removed rows
+        self.lines = lines
+        self.tall = tall
+        self.stream.write("".join(out))
+        self.stream.flush()
+
+
 if __name__ == "__main__":
     a = formated_print()
     a.error("Test error")
@@ -0,0 +1,130 @@
+"""
+    This module defines the phase timing instrumentation. Wall time is
+    collected per phase and per device when enabled, when disabled a phase
+    costs a method call.
+
+    timing.py
+
+    -*- Mode: Python; coding: utf-8; indent-tabs-mode: t; -*-
+    -*- Mode: Python; c-basic-offset: 4; tab-width: 4 -*-
+
+    ----------------------------------------------------------------------------
+"""
+
+import json
+import threading
+import time
+
+
+class nullphase:
+    """Phase used when timing is disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class phase:
+    """Phase that adds its wall time to the timings when left"""
+
+    def __init__(self, timings, name, device):
+        self.timings = timings
+        self.name = name
+        self.device = device
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timings.add(self.name, time.perf_counter() - self.start, self.device)
+        return False
+
+
+class timings:
+    """Wall time per phase and per device"""
+
+    def __init__(self):
+        self.enabled = False
+        self.null = nullphase()
+        self.lock = threading.Lock()  # Devices are probed concurrently
+        self.start = None
+        self.phases = {}
+        self.devices = {}
+
+    def enable(self):
+        self.enabled = True
+        self.start = time.perf_counter()
+
+    def phase(self, name, device=None):
+        """Return context manager timing phase name, of device if given"""
+        if not self.enabled:
+            return self.null
+        return phase(self, name, device)
+
+    def add(self, name, seconds, device=None):
+        with self.lock:
+            count, total = self.phases.get(name, (0, 0.0))
+            self.phases[name] = (count + 1, total + seconds)
+            if device is not None:
+                phases = self.devices.setdefault(device, {})
+                phases[name] = phases.get(name, 0.0) + seconds
+
+    def report(self):
+        """Return dict of total, phase and device times in seconds"""
+        return {
+            "total": time.perf_counter() - self.start,
+            "phases": {
+                name: {"count": count, "seconds": total}
+                for name, (count, total) in self.phases.items()
+            },
+            "devices": {name: self.devices[name] for name in sorted(self.devices)},
+        }
+
+    def serialise(self):
+        return json.dumps(self.report(), separators=(",", ":"))  # Compact
+
+    def lines(self):
+        """Return report as lines of text"""
+        report = self.report()
+        res = [f"{'PHASE':<20} {'COUNT':>6} {'MS':>10}"]
+        for name, values in report["phases"].items():
+            ms = values["seconds"] * 1000
+            res.append(f"{name:<20} {values['count']:>6} {ms:>10.3f}")
+        res.append(f"{'total':<20} {'':>6} {report['total'] * 1000:>10.3f}")
+
+        names = sorted({p for phases in self.devices.values() for p in phases})
+        if names:
+            res.append("")
+            res.append(f"{'DEVICE':<12}" + "".join(f" {n:>10}" for n in names))
+            for device, phases in report["devices"].items():
+                ms = [f" {phases.get(n, 0.0) * 1000:>10.3f}" for n in names]
+                res.append(f"{device:<12}" + "".join(ms))
+        return res
+
+
+# Timings of this invocation
+timer = timings()
+
+
+if __name__ == "__main__":
+
+    t = timings()
+    with t.phase("disabled"):
+        pass
+    assert t.phases == {}  # nosec B101
+    t.enable()
+    with t.phase("enumeration"):
+        pass
+    with t.phase("size", "/dev/sdb"):
+        pass
+    with t.phase("size", "/dev/sdc"):
+        pass
+    report = t.report()
+    assert report["phases"]["size"]["count"] == 2  # nosec B101
+    assert set(report["devices"]) == {"/dev/sdb", "/dev/sdc"}  # nosec B101
+    print("\n".join(t.lines()))
+
+    print(f"Class {t.__class__.__name__} completed test successfully")
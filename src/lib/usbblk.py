@@ -14,106 +14,58 @@
 import codecs
 import fcntl
 import json
+import mmap
 import os
+import re
 import struct
-from collections import namedtuple
-from hashlib import sha256
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import pyudev
-import usb.core
-import usb.util
 
+from lib.blockio import is_slow
+from lib.devcache import device_identity
 from lib.formatutil import get_human_size  # Size into KB, MB and so on
-
-property_to_attribute = {
-    "device": "DEVNAME",
-    "bus": "ID_BUS",
-    "devtype": "DEVTYPE",
-    "type": "ID_TYPE",
-    "driver": "ID_USB_DRIVER",
-    "usbver": "?",
-    "speed": "?",
-    "drive_thumb": "ID_DRIVE_THUMB",
-    "vendor": "ID_VENDOR",
-    "vendor_enc": "ID_VENDOR_ENC",
-    "vendor_str": "?",
-    "model": "ID_MODEL",
-    "model_enc": "ID_MODEL_ENC",
-    "model_str": "?",
-    "revision": "ID_REVISION",
-    "size": "?",
-    "vid": "ID_VENDOR_ID",
-    "pid": "ID_MODEL_ID",
-    "id": "?",
-    "serial": "ID_SERIAL_SHORT",
-    "serial_long": "ID_SERIAL",
-    "interfaces": "ID_USB_INTERFACES",  # Class SubClass Protocol
-    "interface_num": "ID_USB_INTERFACE_NUM",
-    "label": "ID_FS_LABEL",
-    "fs": "ID_FS_TYPE",
-    "devbus": "?",
-    "devaddr": "?",
-    "busaddr": "?",
-    "major": "MAJOR",
-    "minor": "MINOR",
-    "usec": "USEC_INITIALIZED",
-    "chksum": "?",
-}
-
-all_prop = property_to_attribute.keys()
-
-chksum_prop = [
-    "bus",
-    "devtype",
-    "type",
-    "driver",
-    "drive_thumb",
-    "vendor",
-    "vendor_enc",
-    "model",
-    "model_enc",
-    "revision",
-    "size",
-    "vid",
-    "pid",
-    "serial",
-    "serial_long",
-    "interfaces",
-    "interface_num",
-]
-
-# Verify that the chksum_props list validity
-for prop in chksum_prop:
-    if prop not in all_prop:
-        raise ValueError('Checksum property: "' + prop + '" not part of all properies')
+from lib.timing import timer  # Phase timing instrumentation
+from lib.usbprop import all_prop, chksum_prop, property_to_attribute
 
 
 class keyvaluestore:
-    """general attribute store"""
+    """general attribute store with a fixed set of keys. Values are kept in
+    a list, positions are looked up in a key to index map that is shared by
+    all stores with the same keys."""
+
+    __slots__ = ("index", "values")
+
+    indexes = {}  # Key to index map per set of keys
 
     def __init__(self, keys):
-        self.store = dict.fromkeys(keys)
+        keys = tuple(keys)
+        index = keyvaluestore.indexes.get(keys)
+        if index is None:
+            index = {key: i for i, key in enumerate(keys)}
+            index = keyvaluestore.indexes.setdefault(keys, index)
+        self.index = index
+        self.values = [None] * len(index)
 
     def set(self, key, value):
-        if key in self.store:
-            self.store[key] = value
-        else:
-            raise ValueError('Key: "' + key + '" not found in store')
+        try:
+            self.values[self.index[key]] = value
+        except KeyError:
+            raise ValueError('Key: "' + key + '" not found in store') from None
 
     def get(self, key):
-        if key in self.store:
-            return self.store[key]
-        else:
-            raise ValueError('Key: "' + key + '" not found in store')
+        try:
+            return self.values[self.index[key]]
+        except KeyError:
+            raise ValueError('Key: "' + key + '" not found in store') from None
 
     def get_all(self):
-        return self.store
+        return dict(zip(self.index, self.values))
 
     def is_populated(self):
-        for key in self.store:
-            if self.store[key] is None:
-                return False
-        return True
+        return None not in self.values
 
 
 def get_raw_device_size(device_path):
@@ -132,23 +84,111 @@ def get_raw_device_size(device_path):
         return 0
 
 
+def read_sysfs_attributes(sys_path, names):
+    """Return dict of the named sysfs attributes found in directory sys_path,
+    attributes that could not be read are left out"""
+    values = {}
+    for name in names:
+        try:
+            with open(os.path.join(sys_path, name), "rb") as f:
+                values[name] = f.read().decode("ascii", "replace").strip()
+        except OSError:
+            pass
+    return values
+
+
+def get_sysfs_device_size(sys_path):
+    """Size in bytes from sysfs without opening the device node, None if not
+    available. The size attribute is always counted in 512 byte sectors,
+    independent of the logical block size of the device."""
+    attributes = read_sysfs_attributes(sys_path, ["size"])
+    try:
+        return int(attributes["size"]) * 512
+    except (KeyError, ValueError):
+        return None
+
+
+def get_device_size(sys_path, device_path):
+    """Size in bytes from sysfs, from BLKGETSIZE64 if sysfs not available"""
+    size = get_sysfs_device_size(sys_path)
+    if size is None:
+        size = get_raw_device_size(device_path)
+    return size
+
+
+# Seconds a read blocked on a failing device is given beyond the timeout
+throughput_grace = 10.0
+
+
+def call_with_deadline(timeout, func, *args):
+    """Return result of func(*args), raise TimeoutError if it has not
+    returned within timeout seconds. The call is made in a daemon thread that
+    is abandoned on timeout, as a process blocked in the kernel on a failing
+    device can not be interrupted. No deadline if timeout is None."""
+    if timeout is None:
+        return func(*args)
+
+    result = {}
+
+    def run():
+        try:
+            result["value"] = func(*args)
+        except Exception as e:  # Reraised in the calling thread
+            result["error"] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        raise TimeoutError(f"{func.__name__} did not return within {timeout}s")
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
+
+
 def shasum(line):
     """Make sha256 digest of line"""
+    from hashlib import sha256
+
     h = sha256()
     h.update(line.encode())
     return h.hexdigest()
 
 
+def cache_dir():
+    """Return directory for cached files, $XDG_CACHE_HOME/lsusbblk"""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "lsusbblk")
+
+
 class usbids:
     """Class that parses usb id list file and provides vid and pid
-    to vid string and pid string lookup"""
+    to vid string and pid string lookup.
+
+    The id list is compiled into a binary index that is cached and
+    memory mapped on first lookup. The index is rebuilt when the
+    modification time or size of the id list file changes. Layout of the
+    index:
+
+        header   magic, source mtime (ns), source size, number of entries
+        entries  sorted fixed width (key, offset, length), key is
+                 vid << 17 | 1 << 16 | pid for devices and vid << 17 for
+                 vendors
+        strings  utf-8 encoded names referenced by the entries
+    """
+
+    magic = b"USBIDX01"
+    header = struct.Struct("<8sQQI")
+    entry = struct.Struct("<QII")
+    vendor_line = re.compile(r"^([0-9a-fA-F]{4})\s+(.*)$")
 
     def __init__(self, localfile="./usb.ids", distrofile="/usr/share/hwdata/usb.ids"):
 
         self.file = None
-        self.vendor = namedtuple("Vendor", ["name", "devices"])
-        self.vendors = dict()
         self.downloaded = False
+        self.index = None
+        self.entries = 0
+        self.lock = threading.Lock()  # Devices are probed concurrently
 
         # Find USB id list
         if os.path.isfile(localfile):
@@ -157,26 +197,117 @@ class usbids:
         elif os.path.isfile(distrofile):
             self.file = distrofile
 
-        if self.file is not None:
-            with codecs.open(self.file, "r", "latin-1") as f:
-                for line in f:
-                    if not line.strip():
-                        continue
-                    line = line.rstrip()
-                    if line.startswith("#"):
-                        continue
-                    if line.startswith(
-                        "# List of known device classes, " + "subclasses and protocols"
-                    ):
-                        break
-                    if not line.startswith("\t"):
-                        current_vendor, name = line.split(None, 1)
-                        self.vendors[current_vendor] = self.vendor(
-                            name=name, devices=dict()
-                        )
-                    if line.startswith("\t"):
-                        device_id, desc = line.lstrip().split(None, 1)
-                        self.vendors[current_vendor].devices[device_id] = desc
+    def _index_file(self):
+        """Return path of the cached index for the id list file"""
+        digest = shasum(os.path.realpath(self.file))[:16]
+        return os.path.join(cache_dir(), "usb.ids-" + digest + ".idx")
+
+    def _parse(self):
+        """Return dict of index key to name parsed from the id list file"""
+        names = {}
+        current_vendor = None
+        with codecs.open(self.file, "r", "latin-1") as f:
+            for line in f:
+                line = line.rstrip()
+                if not line or line.startswith("#"):
+                    continue
+                if not line.startswith("\t"):
+                    # Only vendor lines, ignore classes, languages and so on
+                    match = self.vendor_line.match(line)
+                    current_vendor = None
+                    if match is not None:
+                        current_vendor = int(match.group(1), 16)
+                        names[current_vendor << 17] = match.group(2)
+                elif current_vendor is not None and not line.startswith("\t\t"):
+                    match = self.vendor_line.match(line.lstrip())
+                    if match is not None:
+                        key = current_vendor << 17 | 1 << 16 | int(match.group(1), 16)
+                        names[key] = match.group(2)
+        return names
+
+    def _compile(self, stat):
+        """Return binary index of the id list file"""
+        names = self._parse()
+        entries = bytearray()
+        strings = bytearray()
+        for key in sorted(names):
+            name = names[key].encode()
+            entries += self.entry.pack(key, len(strings), len(name))
+            strings += name
+        head = self.header.pack(self.magic, stat.st_mtime_ns, stat.st_size, len(names))
+        return bytes(head + entries + strings)
+
+    def _valid(self, index, stat):
+        """Return True if index is compiled from the current id list file
+        and is complete, the entries and the strings of the last entry, the
+        strings are stored in entry order, are within the index"""
+        if len(index) < self.header.size:
+            return False
+        magic, mtime, size, entries = self.header.unpack_from(index, 0)
+        if magic != self.magic or mtime != stat.st_mtime_ns or size != stat.st_size:
+            return False
+        strings = self.header.size + entries * self.entry.size
+        if len(index) < strings:
+            return False
+        if entries:
+            _, offset, length = self.entry.unpack_from(index, strings - self.entry.size)
+            return strings + offset + length <= len(index)
+        return True
+
+    def _load(self, stale=False):
+        """Map the cached index, compile and store it if missing or stale"""
+        stat = os.stat(self.file)
+        path = self._index_file()
+
+        index = None
+        if not stale:
+            try:
+                with open(path, "rb") as f:
+                    index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                if not self._valid(index, stat):
+                    index.close()
+                    index = None
+            except (OSError, ValueError):
+                index = None
+
+        if index is None:
+            with timer.phase("ids_compile"):
+                index = self._compile(stat)
+            tmp = path + "." + str(os.getpid())
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(tmp, "wb") as f:
+                    f.write(index)
+                os.replace(tmp, path)
+            except OSError:
+                try:
+                    os.remove(tmp)  # Partly written
+                except OSError:
+                    pass  # Cache not writable, use the index from memory
+
+        self.index = index
+        self.entries = self.header.unpack_from(index, 0)[3]
+
+    def _lookup(self, key):
+        """Binary search for key in index, return name or None. Raises
+        struct.error or ValueError if the index is damaged."""
+        low, high = 0, self.entries
+        base = self.header.size
+        while low < high:
+            mid = (low + high) // 2
+            found, offset, length = self.entry.unpack_from(
+                self.index, base + mid * self.entry.size
+            )
+            if found == key:
+                start = base + self.entries * self.entry.size + offset
+                if start + length > len(self.index):
+                    raise ValueError(f"Name of {key:#x} outside of the index")
+                return bytes(self.index[start : start + length]).decode()
+            if found < key:
+                low = mid + 1
+            else:
+                high = mid
+        return None
 
     def file_is_loaded(self):
         """Return True if USB id file was found"""
@@ -191,99 +322,436 @@ class usbids:
         vidstr = "None"
         pidstr = "None"
 
-        if vid in self.vendors:
-            vidstr = self.vendors[vid].name
-            if pid in self.vendors[vid].devices:
-                pidstr = self.vendors[vid].devices[pid]
+        # Map the index on first lookup
+        with self.lock:
+            if self.index is None and self.file is not None:
+                try:
+                    with timer.phase("ids_load"):
+                        self._load()
+                except OSError:
+                    self.file = None
+        if not self.entries:
+            return vidstr, pidstr
+        try:
+            vid, pid = int(vid, 16), int(pid, 16)
+        except (TypeError, ValueError):
+            return vidstr, pidstr
+
+        try:
+            return self._names(vid, pid)
+        except (struct.error, ValueError):
+            # Index damaged after it was validated, compile it again
+            with self.lock:
+                try:
+                    self._load(stale=True)
+                except OSError:
+                    return vidstr, pidstr
+            return self._names(vid, pid)
+
+    def _names(self, vid, pid):
+        """Return string representation of vid and pid given as integers"""
+        vidstr = "None"
+        pidstr = "None"
+        name = self._lookup(vid << 17)
+        if name is not None:
+            vidstr = name
+            name = self._lookup(vid << 17 | 1 << 16 | pid)
+            if name is not None:
+                pidstr = name
 
         return vidstr, pidstr
 
 
-class usbdevice(keyvaluestore):
+# Link speed in Mbit/s as found in sysfs to libusb speed code
+sysfs_speed = {"1.5": 1, "12": 2, "480": 3, "5000": 4, "10000": 5, "20000": 6}
 
-    def _find_devices(vid, pid, serial):
-        """Returns a list of devices with given vid, pid and serial"""
 
-        devices = []
-        for device in usb.core.find(idVendor=vid, idProduct=pid, find_all=1):
-            devices.append(device)
+def sysfs_attribute(device, name):
+    """Return sysfs attribute of udev device as stripped string or None"""
+    value = device.attributes.get(name)
+    if value is None:
+        return None
+    return value.decode("ascii", "replace").strip()
+
 
-        # If more than one device, locate device with correct serial number
-        if len(devices) > 1:
-            devices = []
-            for device in usb.core.find(idVendor=vid, idProduct=pid, find_all=1):
+def sysfs_location(device):
+    """Return bus, address, USB version and speed of the USB device that the
+    udev block device belongs to, as found in the sysfs attributes of the
+    parent usb_device node. Returns None if not available."""
+    try:
+        parent = device.find_parent("usb", "usb_device")
+    except (OSError, ValueError):
+        parent = None
+    if parent is None:
+        return None
+
+    busnum = sysfs_attribute(parent, "busnum") or parent.properties.get("BUSNUM")
+    devnum = sysfs_attribute(parent, "devnum") or parent.properties.get("DEVNUM")
+    version = sysfs_attribute(parent, "version")
+    speed = sysfs_attribute(parent, "speed")
+    if None in (busnum, devnum, version, speed):
+        return None
+
+    try:
+        # Version is bcdUSB formated as "%2x.%02x"
+        major, minor = version.split(".")
+        return {
+            "devbus": str(int(busnum)),
+            "devaddr": str(int(devnum)),
+            "usbver": f"USB {int(major, 16)}.{int(minor[0], 16)}",
+            "speed": str(sysfs_speed.get(speed, 0)),
+        }
+    except ValueError:
+        return None
+
+
+def libusb_location(device):
+    """Return bus, address, USB version and speed of a pyusb device"""
+    major = f"{(device.bcdUSB & 0xff00)>>8}"
+    minor = f"{(device.bcdUSB & 0xf0)>>4}"
+    return {
+        "devbus": str(device.bus),
+        "devaddr": str(device.address),
+        "usbver": f"USB {major}.{minor}",
+        "speed": str(device.speed),
+    }
+
+
+class usbbus:
+    """Single pass enumeration of the USB bus, indexed by vid, pid and serial.
+    The bus is enumerated on first lookup, that is only if sysfs did not
+    provide the information."""
+
+    def __init__(self):
+        self.index = None
+        self.serials = {}
+        self.lock = threading.Lock()  # Devices are probed concurrently
+
+    def _scan(self):
+        with timer.phase("libusb_scan"):
+            self._scan_bus()
+
+    def _scan_bus(self):
+        index = {}
+        try:
+            import usb.core  # libusb is only used when sysfs lacks the information
+        except ImportError:
+            usb = None
+        if usb is not None:
+            try:
+                for device in usb.core.find(find_all=True):
+                    key = (device.idVendor, device.idProduct)
+                    index.setdefault(key, []).append(device)
+            except (usb.core.USBError, usb.core.NoBackendError):
+                pass
+        self.index = index
+
+    def _serial_index(self, key):
+        """Return serial number to devices map for devices sharing vid and pid.
+        Serial numbers are only read, one control transfer per device, when
+        more than one device with the same vid and pid is attached."""
+        if key not in self.serials:
+            serials = {}
+            for device in self.index[key]:
                 try:
-                    if device.serial_number == serial:
-                        devices.append(device)
+                    serials.setdefault(device.serial_number, []).append(device)
                 except ValueError:
                     # if user not root by pass known bug(?) in usb.core
                     pass
+            self.serials[key] = serials
+        return self.serials[key]
 
-        return devices
+    def find(self, vid, pid, serial):
+        """Returns a list of devices with given vid, pid and serial"""
+        with self.lock:
+            if self.index is None:
+                self._scan()
+
+            key = (vid, pid)
+            devices = self.index.get(key, [])
+
+            # If more than one device, locate device with correct serial number
+            if len(devices) > 1:
+                devices = self._serial_index(key).get(serial, [])
+
+            return devices
 
-    def __init__(self, device, human_readable, usbids):
+
+class usbdevice(keyvaluestore):
+    """USB block device. Properties found in the udev database are stored when
+    the device is created. Derived properties are computed on first access
+    by their resolver and then kept, so only what is asked for is probed.
+
+    Each probe stage runs under a deadline. Properties of a stage that did
+    not finish in time are set to "timeout" and so is the status property,
+    which otherwise is "ok"."""
+
+    __slots__ = (
+        "udev",
+        "human_readable",
+        "usbids",
+        "usbbus",
+        "timeout",
+        "raw_size",
+        "throughput",
+    )
+
+    # Derived property: resolver method and properties the resolver depends on
+    resolvers = {
+        "id": ("_resolve_id", ["vid", "pid"]),
+        "size": ("_resolve_size", ["device"]),
+        "vendor_str": ("_resolve_ids", ["vid", "pid"]),
+        "model_str": ("_resolve_ids", ["vid", "pid"]),
+        "devbus": ("_resolve_location", ["vid", "pid", "serial"]),
+        "devaddr": ("_resolve_location", ["vid", "pid", "serial"]),
+        "busaddr": ("_resolve_location", ["vid", "pid", "serial"]),
+        "usbver": ("_resolve_location", ["vid", "pid", "serial"]),
+        "speed": ("_resolve_location", ["vid", "pid", "serial"]),
+        "chksum": ("_resolve_chksum", chksum_prop),
+        "read_mbs": ("_resolve_throughput", ["device", "size", "devbus"]),
+        "read_p50": ("_resolve_throughput", ["device", "size", "devbus"]),
+        "read_p99": ("_resolve_throughput", ["device", "size", "devbus"]),
+        "slow": ("_resolve_slow", ["read_mbs", "speed"]),
+    }
+
+    # Probed properties kept in the inventory cache. The size is not cached,
+    # it changes with the media of a card reader and is cheap to read
+    cached_prop = [
+        "vendor_str",
+        "model_str",
+        "devbus",
+        "devaddr",
+        "busaddr",
+        "usbver",
+        "speed",
+    ]
+
+    def __init__(
+        self, device, human_readable, usbids, usbbus, timeout=None, throughput=None
+    ):
         super().__init__(all_prop)  # Initiate with all properties
-        for prop in all_prop:
-            self.set(prop, "?")
+        self.udev = device
+        self.human_readable = human_readable
+        self.usbids = usbids
+        self.usbbus = usbbus
+        self.timeout = timeout
+        self.throughput = throughput
+        self.raw_size = None
 
         getprop = device.properties.get
 
         # Get properties from udev
-        for key, value in property_to_attribute.items():
-            if value != "?":
-                self.set(key, str(getprop(value)))
+        with timer.phase("udev", getprop("DEVNAME")):
+            for key, value in property_to_attribute.items():
+                if value != "?":
+                    self.set(key, str(getprop(value)))
+        self.set("status", "ok")
+
+    def _stage(self, keys, func, *args):
+        """Run probe stage under the deadline. Returns the result of the
+        stage or None if timed out, in which case keys are set to timeout."""
+        try:
+            return call_with_deadline(self.timeout, func, *args)
+        except TimeoutError:
+            self._timed_out(keys)
+            return None
 
-        self.set("size", str(get_raw_device_size(self.get("device"))))
-        self.set("id", self.get("vid") + ":" + self.get("pid"))
+    def _timed_out(self, keys):
+        """Set keys, and the status of the device, to timeout"""
+        for key in keys:
+            self.set(key, "timeout")
+        self.set("status", "timeout")
 
-        # Get list of devices from USB core package
-        devices = usbdevice._find_devices(
-            int(self.get("vid"), 16), int(self.get("pid"), 16), self.get("serial")
-        )
+    def get(self, key):
+        """Return property, resolve it and its dependencies if not known"""
+        try:
+            value = self.values[self.index[key]]
+        except KeyError:
+            raise ValueError('Key: "' + key + '" not found in store') from None
+        if value is None:
+            resolver, dependencies = self.resolvers[key]
+            for dependency in dependencies:
+                self.get(dependency)
+            name = resolver[len("_resolve_") :]
+            with timer.phase(name, super().get("device")):
+                getattr(self, resolver)()
+            value = super().get(key)
+        return value
 
-        # Get string representation of VID and PID from USB id list
-        vidstr, pidstr = usbids.getids(self.get("vid"), self.get("pid"))
-        self.set("vendor_str", vidstr)
-        self.set("model_str", pidstr)
+    def get_all(self):
+        for key in all_prop:
+            self.get(key)
+        return super().get_all()
 
-        """
-        Set if one and only one device with specified vid, pid and serial is
-        found. Note that some manufacture do not provide device unique serial
-        numbers.
-        """
-        if len(devices) == 1:
-            device = devices[0]
-            self.set("devbus", str(device.bus))
-            self.set("devaddr", str(device.address))
+    def _resolve_id(self):
+        self.set("id", self.get("vid") + ":" + self.get("pid"))
+
+    def _resolve_size(self):
+        size = self._stage(
+            ["size"], get_device_size, self.udev.sys_path, self.get("device")
+        )
+        if size is not None:
+            self._set_size(size)
+
+    def _set_size(self, size):
+        """Set size in bytes and presented according to human_readable"""
+        self.raw_size = size
+        if self.human_readable:
+            self.set("size", get_human_size(self.raw_size))
+        else:
+            self.set("size", str(self.raw_size))
+
+    def set_human_readable(self, human_readable):
+        """Change presentation of size"""
+        self.human_readable = human_readable
+        if self.raw_size is not None:
+            self._set_size(self.raw_size)
+
+    def _resolve_ids(self):
+        """Get string representation of VID and PID from USB id list"""
+        keys = ["vendor_str", "model_str"]
+        ids = self._stage(keys, self.usbids.getids, self.get("vid"), self.get("pid"))
+        if ids is not None:
+            self.set("vendor_str", ids[0])
+            self.set("model_str", ids[1])
+
+    def _locate(self):
+        """Get bus, address, version and speed from sysfs, else from libusb"""
+        location = sysfs_location(self.udev)
+        if location is None:
+            """
+            Set if one and only one device with specified vid, pid and serial
+            is found. Note that some manufacture do not provide device unique
+            serial numbers.
+            """
+            try:
+                devices = self.usbbus.find(
+                    int(self.get("vid"), 16),
+                    int(self.get("pid"), 16),
+                    self.get("serial"),
+                )
+            except ValueError:
+                devices = []
+            if len(devices) == 1:
+                location = libusb_location(devices[0])
+        return location
+
+    def _resolve_location(self):
+        keys = ["devbus", "devaddr", "busaddr", "usbver", "speed"]
+        for key in keys:
+            self.set(key, "?")
+
+        location = self._stage(keys, self._locate)
+        if location is not None:
+            for key, value in location.items():
+                self.set(key, value)
             self.set(
                 "busaddr",
                 "{:03d}".format(int(self.get("devbus")))
                 + ":"
                 + "{:03d}".format(int(self.get("devaddr"))),
             )
-            major = f"{(device.bcdUSB & 0xff00)>>8}"
-            minor = f"{(device.bcdUSB & 0xf0)>>4}"
-            self.set("usbver", f"USB {major}.{minor}")
-            self.set("speed", str(device.speed))
 
-        # calculate checksum of static device properties
+    def _resolve_chksum(self):
+        """calculate checksum of static device properties, size in bytes"""
+        if self.get("size") == "timeout":
+            self.set("chksum", "timeout")
+            return
         chksum_text = ""
         for a in chksum_prop:
-            chksum_text += self.get(a)
+            if a == "size":
+                chksum_text += str(self.raw_size)
+            else:
+                chksum_text += self.get(a)
         self.set("chksum", shasum(chksum_text))
 
-        if human_readable:
-            self.set("size", get_human_size(int(self.get("size"))))
-
-        self.label_size = dict.fromkeys(self.store.keys())
-        for key in self.label_size:
-            self.label_size[key] = len(self.get(key))
+    def _resolve_throughput(self):
+        """Measure read throughput and latency with the throughput sampler,
+        the device is only read if a sampler is given.
+
+        The sampler stops reading after timeout seconds, the slow devices
+        the measurement is made to find are not timed out but slow. A read
+        blocked in the kernel on a failing device is abandoned after a grace
+        period, the bus stays held by it and the devices sharing the bus
+        time out until it returns."""
+        for key in ["read_mbs", "read_p50", "read_p99"]:
+            self.set(key, "?")
+        if self.throughput is None or not self.raw_size:
+            return
+
+        # Devices sharing the bus are measured one at a time
+        keys = ["read_mbs", "read_p50", "read_p99", "slow"]
+        path = self.get("device")
+        bus = self.get("devbus")
+        if not self.throughput.acquire_bus(bus):
+            self._timed_out(keys)
+            return
+        done = threading.Event()
+
+        def measure():
+            try:
+                return self.throughput.measure(path, self.raw_size, self.timeout)
+            finally:
+                self.throughput.release_bus(bus, done)
+
+        limit = None if self.timeout is None else self.timeout + throughput_grace
+        try:
+            result = call_with_deadline(limit, measure)
+        except TimeoutError:
+            self.throughput.abandon_bus(bus, done)
+            self._timed_out(keys)
+            return
+        except OSError:
+            return
+        self.set("read_mbs", f"{result['mbs']:.1f}")
+        self.set("read_p50", f"{result['p50']:.2f}")
+        self.set("read_p99", f"{result['p99']:.2f}")
+        if not result["complete"]:
+            self.set("slow", "yes")
+
+    def _resolve_slow(self):
+        """Flag device delivering far less than its negotiated speed"""
+        try:
+            slow = is_slow(float(self.get("read_mbs")), int(self.get("speed")))
+        except ValueError:
+            slow = None
+        self.set("slow", "?" if slow is None else ("yes" if slow else "no"))
+
+    def identity(self):
+        """Return inventory cache key of device"""
+        return device_identity(self.udev)
+
+    def cached(self):
+        """Return probed values to be cached, values that timed out or not yet
+        resolved are left out"""
+        values = {}
+        for key in self.cached_prop:
+            value = super().get(key)
+            if value is not None and value != "timeout":
+                values[key] = value
+        return values
+
+    def preload(self, values):
+        """Set values from the inventory cache"""
+        for key in self.cached_prop:
+            if key in values:
+                self.set(key, values[key])
+
+    def probe(self, keys):
+        """Resolve given properties"""
+        for key in keys:
+            self.get(key)
+        return self
+
+    def get_label_size(self, key):
+        """Return length of property value"""
+        return len(self.get(key))
 
     def __str__(self):
         return self.get("device")
 
     def get_labels(self):
-        return self.store.keys()
+        return self.index.keys()
 
     def serialise(self, keys=None):
         if keys is None:
@@ -303,19 +771,299 @@ class usbdevice(keyvaluestore):
         print(self.get_all())
 
 
+def is_usb_disk(device):
+    """Return True if udev device is a USB attached disk"""
+    return device.get("ID_BUS") == "usb" and device.get("DEVTYPE") == "disk"
+
+
+def count_usb_disks():
+    """Return number of USB disks in the udev database without probing them"""
+    context = pyudev.Context()
+    return sum(1 for d in context.list_devices(subsystem="block") if is_usb_disk(d))
+
+
 class usbblk:
 
-    def __init__(self, human_readable):
-        self.context = pyudev.Context()
+    def __init__(
+        self,
+        human_readable,
+        ids=None,
+        device=None,
+        jobs=8,
+        timeout=None,
+        cache=None,
+        context=None,
+        throughput=None,
+    ):
+        """Enumerate USB block devices. If device, a device node, is given
+        only that device is looked up, probed and followed. Devices are probed by
+        jobs parallel workers, 1 probes the devices one by one. Each probe
+        stage of a device is given timeout seconds, None waits forever.
+        Probed values are reused from and stored in cache, a loaded
+        devicecache, unless None. Devices are enumerated from context,
+        default a new pyudev.Context. Read throughput is measured with
+        throughput, a lib.blockio.sampler, unless None."""
+        self.context = pyudev.Context() if context is None else context
         self.devices = {}
-        self.usbids = usbids()
+        self.usbids = usbids() if ids is None else ids
+        self.human_readable = human_readable
+        self.jobs = max(1, jobs)
+        self.timeout = timeout
+        self.cache = cache
+        self.throughput = throughput
+        self.complete = device is None  # All attached devices enumerated
+        self.only = device
+        self.excluded = {}  # Names removed by select, to identities
+        self.monitor = None
+        self.pending = []
+
+        # Enumerate the USB bus once for all devices of this scan
+        self.usbbus = usbbus()
+        with timer.phase("enumeration"):
+            if device is not None:
+                udev = self.find(device)
+                if udev is not None:
+                    self.add(udev)
+            else:
+                for udev in self.context.list_devices(subsystem="block"):
+                    if is_usb_disk(udev):
+                        self.add(udev)
+
+    def find(self, name):
+        """Return udev device of USB disk with device node name or None"""
+        try:
+            device = pyudev.Devices.from_device_file(self.context, name)
+        except (pyudev.DeviceNotFoundError, OSError, ValueError):
+            return None
+        if is_usb_disk(device) and device.get("DEVNAME") == name:
+            return device
+        return None
+
+    def add(self, device, cached=True):
+        """Probe udev device and add it to the inventory, return its name.
+        Probed values are reused from the cache if cached."""
+        name = device.get("DEVNAME")
+        self.devices[name] = usbdevice(
+            device,
+            self.human_readable,
+            self.usbids,
+            self.usbbus,
+            self.timeout,
+            self.throughput,
+        )
+        if cached and self.cache is not None:
+            values = self.cache.lookup(self.devices[name].identity())
+            if values is not None:
+                self.devices[name].preload(values)
+        return name
+
+    def set_human_readable(self, human_readable):
+        """Change presentation of size of all devices"""
+        self.human_readable = human_readable
+        for device in self.devices.values():
+            device.set_human_readable(human_readable)
+
+    def save_cache(self):
+        """Store probed values of all devices in the inventory cache"""
+        if self.cache is None:
+            return
+        present = set()
+        for device in self.devices.values():
+            present.add(device.identity())
+            self.cache.store(device.identity(), device.cached())
+        present.update(self.excluded.values())
+        self.cache.save(present if self.complete else None)
+
+    def remove(self, name):
+        """Remove device from the inventory"""
+        self.devices.pop(name, None)
+
+    def exclude(self, name):
+        """Remove device from the inventory until it is attached again. The
+        device is still attached, its cache entry is kept."""
+        self.excluded[name] = self.devices[name].identity()
+        self.remove(name)
+
+    def in_scope(self, name):
+        """Return True if device name is followed by the inventory"""
+        if self.only is not None and name != self.only:
+            return False
+        return name not in self.excluded
+
+    def start_monitor(self):
+        """Start listening for udev block disk events.
+
+        Devices attached between the initial enumeration and the start of the
+        monitor are picked up by comparing udev names against the inventory
+        and queued as added. Devices left out on purpose, other than the
+        given device or excluded by select, are not.
+        """
+        if self.monitor is not None:
+            return
 
+        self.monitor = pyudev.Monitor.from_netlink(self.context)
+        self.monitor.filter_by(subsystem="block", device_type="disk")
+        self.monitor.start()
+
+        missed = []
         for device in self.context.list_devices(subsystem="block"):
-            if device.get("ID_BUS") == "usb":
-                if device.get("DEVTYPE") == "disk":
-                    self.devices[device.get("DEVNAME")] = usbdevice(
-                        device, human_readable, self.usbids
-                    )
+            name = device.get("DEVNAME")
+            if is_usb_disk(device) and name not in self.devices:
+                if self.in_scope(name):
+                    missed.append(device)
+        if missed:
+            self.usbbus = usbbus()  # Bus changed since the last scan
+        for device in missed:
+            self.pending.append(("add", self.add(device)))
+
+    def handle_event(self, device):
+        """Update the inventory from a udev event.
+
+        Returns tuple (action, name) where action is "add", "remove" or
+        "change", or None if the event did not change the inventory. A
+        changed device, e.g. new media in a card reader, is probed again.
+        Events of devices other than the given device are ignored, devices
+        excluded by select are added again when attached or changed.
+        """
+        name = device.get("DEVNAME")
+        if self.only is not None and name != self.only:
+            return None
+        if device.action == "remove":
+            self.excluded.pop(name, None)
+            if name in self.devices:
+                self.remove(name)
+                return "remove", name
+        elif device.action in ("add", "change"):
+            if is_usb_disk(device) and name not in self.devices:
+                self.excluded.pop(name, None)
+                self.usbbus = usbbus()  # Bus changed since the last scan
+                return "add", self.add(device)
+            if device.action == "change" and name in self.devices:
+                if is_usb_disk(device):
+                    return "change", self.add(device, cached=False)
+                self.remove(name)
+                return "remove", name
+        return None
+
+    def wait_event(self, timeout=None):
+        """Block until the inventory changes or timeout (seconds) expires.
+
+        Returns tuple (action, name) or None on timeout.
+        """
+        self.start_monitor()
+        if self.pending:
+            return self.pending.pop(0)
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if deadline is not None:
+                timeout = max(0.0, deadline - time.monotonic())
+            device = self.monitor.poll(timeout)
+            if device is None:
+                return None
+            event = self.handle_event(device)
+            if event is not None:
+                return event
+
+    def wait_added(
+        self, count=1, settle=0.0, timeout=None, expression=None, report=None
+    ):
+        """Block until count devices are added or timeout (seconds) expires
+        and return the names of the added devices still attached.
+
+        Events arriving within settle seconds of the previous event are
+        coalesced into the batch, also after count devices are added, so a
+        burst of devices is returned at once. Added devices not matching
+        the filter expression are dropped and not counted. The remaining
+        events are passed to report, if given, as they arrive.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        added = []
+        while True:
+            wait = None
+            if len(added) >= count:
+                if settle <= 0:
+                    break
+                wait = settle
+            if deadline is not None:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                wait = left if wait is None else min(wait, left)
+
+            event = self.wait_event(wait)
+            if event is None:
+                if len(added) >= count:
+                    break  # Settled
+                continue
+
+            action, name = event
+            if action == "remove" and name in added:
+                added.remove(name)
+            elif action == "add":
+                if expression is not None:
+                    self.select(expression, [name])
+                    if self.get(name) is None:
+                        continue
+                added.append(name)
+            if report is not None:
+                report(event)
+        return added
+
+    def events(self):
+        """Generator of inventory changes as tuples (action, name)"""
+        while True:
+            yield self.wait_event()
+
+    def probe(self, properties=None, names=None):
+        """Resolve properties, default all, of the named devices, default
+        all devices. Devices are probed concurrently by the worker pool,
+        the inventory order is not affected."""
+        for _ in self.iter_probe(properties, names):
+            pass
+
+    def iter_probe(self, properties=None, names=None):
+        """Generator that probes as probe() and yields each device as soon
+        as its properties are resolved, in order of completion"""
+        if properties is None:
+            properties = list(all_prop)
+        if names is None:
+            names = self.get_device_list()
+        devices = [self.devices[name] for name in names if name in self.devices]
+
+        if self.jobs == 1 or len(devices) < 2:
+            for device in devices:
+                yield device.probe(properties)
+            return
+
+        with ThreadPoolExecutor(max_workers=min(self.jobs, len(devices))) as pool:
+            futures = [pool.submit(device.probe, properties) for device in devices]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def select(self, expression, names=None):
+        """Exclude the named devices, default all, that do not match the filter
+        expression. The expression is first evaluated with the properties
+        from udev, only devices not decided by those are probed for the
+        properties of the expression."""
+        if names is None:
+            names = self.get_device_list()
+
+        undecided = []
+        for name in names:
+            result = expression.evaluate(self.devices[name], cheap=True)
+            if result is False:
+                self.exclude(name)
+            elif result is None:
+                undecided.append(name)
+
+        properties = list(expression.properties)
+        if "status" in properties:
+            properties = list(all_prop)  # Known once all probe stages ran
+        self.probe(properties, undecided)
+        for name in undecided:
+            if not expression.evaluate(self.devices[name]):
+                self.exclude(name)
 
     def get(self, name):
         if name in self.devices:
@@ -326,7 +1074,7 @@ class usbblk:
     def get_label_size_of_key(self, key):
         size = len(key)
         for dev in self.devices:
-            size = max(size, self.devices[dev].label_size[key])
+            size = max(size, self.devices[dev].get_label_size(key))
         return size
 
     def get_devices(self):
@@ -351,14 +1099,15 @@ class usbblk:
         for device in self.get_device_list():
             self.devices[device].display()
 
-    def serialise(self, properties=None, device=None):
+    def serialise(self, properties=None, device=None, names=None):
+        """Return JSON of the device, or of the named devices, default all"""
         res = "{"
         if device is not None:
             res += '"' + device + '":'
             res += self.devices[device].serialise(properties)
         else:
             first = True
-            for dev in self.get_device_list():
+            for dev in self.get_device_list() if names is None else names:
                 if first:
                     first = False
                 else:
@@ -373,11 +1122,10 @@ class usbblk:
         for device in self.devices:
             self.devices[device].debug()
         for device in self.context.list_devices(subsystem="block"):
-            if device.get("ID_BUS") == "usb":
-                if device.get("DEVTYPE") == "disk":
-                    print("-" * 20)
-                    for prop in device.properties:
-                        print(prop + " = " + device.properties.get(prop))
+            if is_usb_disk(device):
+                print("-" * 20)
+                for prop in device.properties:
+                    print(prop + " = " + device.properties.get(prop))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,82 @@
+"""
+    This module defines the properties of USB block devices. It has no
+    dependencies so that the properties can be listed without loading the
+    device backends.
+
+    usbprop.py
+
+    -*- Mode: Python; coding: utf-8; indent-tabs-mode: t; -*-
+    -*- Mode: Python; c-basic-offset: 4; tab-width: 4 -*-
+
+    ----------------------------------------------------------------------------
+"""
+
+property_to_attribute = {
+    "device": "DEVNAME",
+    "bus": "ID_BUS",
+    "devtype": "DEVTYPE",
+    "type": "ID_TYPE",
+    "driver": "ID_USB_DRIVER",
+    "usbver": "?",
+    "speed": "?",
+    "drive_thumb": "ID_DRIVE_THUMB",
+    "vendor": "ID_VENDOR",
+    "vendor_enc": "ID_VENDOR_ENC",
+    "vendor_str": "?",
+    "model": "ID_MODEL",
+    "model_enc": "ID_MODEL_ENC",
+    "model_str": "?",
+    "revision": "ID_REVISION",
+    "size": "?",
+    "vid": "ID_VENDOR_ID",
+    "pid": "ID_MODEL_ID",
+    "id": "?",
+    "serial": "ID_SERIAL_SHORT",
+    "serial_long": "ID_SERIAL",
+    "interfaces": "ID_USB_INTERFACES",  # Class SubClass Protocol
+    "interface_num": "ID_USB_INTERFACE_NUM",
+    "label": "ID_FS_LABEL",
+    "fs": "ID_FS_TYPE",
+    "devbus": "?",
+    "devaddr": "?",
+    "busaddr": "?",
+    "major": "MAJOR",
+    "minor": "MINOR",
+    "usec": "USEC_INITIALIZED",
+    "chksum": "?",
+    "status": "?",
+    "read_mbs": "?",  # Measured only with a throughput sampler
+    "read_p50": "?",
+    "read_p99": "?",
+    "slow": "?",
+}
+
+all_prop = property_to_attribute.keys()
+
+# Properties read from the udev database, all others are probed
+udev_prop = [key for key, value in property_to_attribute.items() if value != "?"]
+
+chksum_prop = [
+    "bus",
+    "devtype",
+    "type",
+    "driver",
+    "drive_thumb",
+    "vendor",
+    "vendor_enc",
+    "model",
+    "model_enc",
+    "revision",
+    "size",
+    "vid",
+    "pid",
+    "serial",
+    "serial_long",
+    "interfaces",
+    "interface_num",
+]
+
+# Verify that the chksum_props list validity
+for prop in chksum_prop:
+    if prop not in all_prop:
+        raise ValueError('Checksum property: "' + prop + '" not part of all properies')